@@ -0,0 +1,62 @@
+import numpy as np
+
+
+# Wraps a FlappySimulation or a VectorFlappyEnv so that every step() applies
+# the same action for `repeat` physics frames and returns the summed reward,
+# which cuts the number of decisions and Q updates per simulated second by
+# that factor. With max_pool the returned distances are the maximum of those
+# observed over the repeated frames instead of the last ones.
+class ActionRepeat:
+    def __init__(self, env, repeat=4, max_pool=False):
+        if repeat < 1:
+            raise ValueError("Action repeat must be at least 1")
+        self.env = env
+        self.repeat = repeat
+        self.max_pool = max_pool
+        self.frames_per_step = repeat * env.frames_per_step
+        self.vectorized = hasattr(env, "num_envs")
+        if self.vectorized:
+            self.num_envs = env.num_envs
+
+    def reset(self):
+        return self.env.reset()
+
+    def step(self, action):
+        if self.vectorized:
+            return self._step_vector(action)
+
+        total_reward = 0
+        pooled = None
+        for i in range(0, self.repeat):
+            observation, reward, done, info = self.env.step(action)
+            total_reward += reward
+            if self.max_pool and pooled is not None:
+                pooled = (max(pooled[0], observation[0]), max(pooled[1], observation[1]))
+            else:
+                pooled = observation
+            if done:
+                break
+        return pooled, total_reward, done, info
+
+    def _step_vector(self, actions):
+        # Games reset on their own as soon as they end, so the remaining
+        # frames of the window are played by their next game. Their rewards
+        # are not counted, their scores are the ones of the game that ended
+        # and pooling starts over from the first observation of the new game.
+        total_rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        scores = np.zeros(self.num_envs, dtype=np.int64)
+        frames = np.zeros(self.num_envs, dtype=np.int64)
+        pooled = None
+        for i in range(0, self.repeat):
+            observations, rewards, step_dones, info = self.env.step(actions)
+            total_rewards += np.where(dones, 0, rewards)
+            scores = np.where(dones, scores, info["scores"])
+            frames = np.where(dones, frames, info["frames"])
+            if self.max_pool and pooled is not None:
+                pooled = tuple(np.where(step_dones, observation, np.maximum(pooled_dist, observation))
+                               for pooled_dist, observation in zip(pooled, observations))
+            else:
+                pooled = observations
+            dones |= step_dones
+        return pooled, total_rewards, dones, {"scores": scores, "frames": frames}
@@ -0,0 +1,188 @@
+import copy
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from simulation import ACTIONS, BIRD_SIZE, BIRD_X, FLOOR, GAP, OFFSET_RANGE, SCREEN_WIDTH, WALL_RESET
+
+# Bounds of the distances FlappySimulation.observation can return
+HORIZONTAL_MIN = WALL_RESET - (BIRD_X + BIRD_SIZE)
+HORIZONTAL_MAX = SCREEN_WIDTH - (BIRD_X + BIRD_SIZE)
+VERTICAL_MIN = (360 + GAP - OFFSET_RANGE + 10) - (FLOOR + BIRD_SIZE)
+VERTICAL_MAX = (360 + GAP + OFFSET_RANGE + 10) - BIRD_SIZE
+
+
+# Buckets the horizontal and vertical distances to the pipe into bins of
+# h_resolution and v_resolution pixels. Works on single observations and on
+# the arrays a VectorFlappyEnv returns.
+class Discretizer:
+    def __init__(self, h_resolution=4, v_resolution=4):
+        self.h_resolution = h_resolution
+        self.v_resolution = v_resolution
+        self.h_bins = (HORIZONTAL_MAX - HORIZONTAL_MIN) // h_resolution + 1
+        self.v_bins = (VERTICAL_MAX - VERTICAL_MIN) // v_resolution + 1
+
+    def __call__(self, observation):
+        horizontal_dist, vertical_dist = observation
+        h = np.clip((np.asarray(horizontal_dist) - HORIZONTAL_MIN) // self.h_resolution, 0, self.h_bins - 1)
+        v = np.clip((np.asarray(vertical_dist) - VERTICAL_MIN) // self.v_resolution, 0, self.v_bins - 1)
+        return h, v
+
+    def bucket(self, horizontal_dist, vertical_dist):
+        # __call__ for a single observation in plain ints, which is several
+        # times cheaper than going through numpy for one value
+        h = min(max((horizontal_dist - HORIZONTAL_MIN) // self.h_resolution, 0), self.h_bins - 1)
+        v = min(max((vertical_dist - VERTICAL_MIN) // self.v_resolution, 0), self.v_bins - 1)
+        return h, v
+
+
+# Q learning over the discretized distances. The table is a dense
+# [h_bins, v_bins, 2] array whose last axis is indexed like
+# simulation.ACTIONS, so picking an action is one argmax and a whole batch of
+# transitions can be updated at once.
+class QAgent:
+    def __init__(self, alpha=0.3, gamma=0.9, epsilon=0.0, h_resolution=4, v_resolution=4, seed=None):
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.discretizer = Discretizer(h_resolution, v_resolution)
+        self.q = np.zeros((self.discretizer.h_bins, self.discretizer.v_bins, len(ACTIONS)))
+        self.rng = np.random.default_rng(seed)
+
+    def choose_indexes(self, observations):
+        # Actions, as ACTIONS indexes, for a batch of observations
+        h, v = self.discretizer(observations)
+        actions = np.argmax(self.q[h, v], axis=-1)
+        if self.epsilon > 0:
+            explore = self.rng.random(actions.shape) < self.epsilon
+            actions = np.where(explore, self.rng.integers(0, len(ACTIONS), actions.shape), actions)
+        return actions
+
+    def choose(self, observation):
+        if self.epsilon > 0 and self.rng.random() < self.epsilon:
+            return ACTIONS[self.rng.integers(0, len(ACTIONS))]
+        h, v = self.discretizer.bucket(*observation)
+        return ACTIONS[self.q[h, v].argmax()]
+
+    def learn_batch(self, observations, actions, rewards, next_observations, dones):
+        # Q[s,a] ← Q[s,a] + α (r + γ * V(s') - Q[s,a])
+        # Transitions of a batch that share a cell all start from its old
+        # value and the last of them wins, which loses some updates but never
+        # overshoots the target.
+        h, v = self.discretizer(observations)
+        next_h, next_v = self.discretizer(next_observations)
+        v_dash = np.where(dones, 0.0, self.q[next_h, next_v].max(axis=-1))
+        original = self.q[h, v, actions]
+        updated = original + self.alpha * (rewards + self.gamma * v_dash - original)
+        self.q[h, v, actions] = updated
+        return updated
+
+    def learn(self, observation, action, reward, next_observation, done=False):
+        h, v = self.discretizer.bucket(*observation)
+        v_dash = 0.0
+        if not done:
+            next_h, next_v = self.discretizer.bucket(*next_observation)
+            v_dash = self.q[next_h, next_v].max()
+        index = ACTIONS.index(action)
+        original = self.q[h, v, index]
+        self.q[h, v, index] = original + self.alpha * (reward + self.gamma * v_dash - original)
+        return self.q[h, v, index]
+
+
+def train(agent, simulation, num_frames):
+    # Headless training loop: as many frames as asked for, as fast as they
+    # can be simulated, resetting the game whenever the bird dies. Frames are
+    # counted from info["frames"], so an ActionRepeat step counts the frames
+    # it actually played, including one cut short by a death.
+    observation = simulation.reset()
+    frames = 0
+    episode_frames = 0
+    episodes = 0
+    best_score = 0
+    while frames < num_frames:
+        action = agent.choose(observation)
+        next_observation, reward, done, info = simulation.step(action)
+        agent.learn(observation, action, reward, next_observation, done)
+        frames += info["frames"] - episode_frames
+        episode_frames = info["frames"]
+        if done:
+            episodes += 1
+            best_score = max(best_score, info["score"])
+            episode_frames = 0
+            observation = simulation.reset()
+        else:
+            observation = next_observation
+    return {"frames": frames, "episodes": episodes, "best_score": best_score}
+
+
+def train_vector(agent, env, num_steps):
+    # train() over a VectorFlappyEnv: every step is one frame of each of its
+    # games, learned from as a single batch
+    observations = env.reset()
+    episodes = 0
+    best_score = 0
+    for step in range(0, num_steps):
+        actions = agent.choose_indexes(observations)
+        next_observations, rewards, dones, info = env.step(actions)
+        agent.learn_batch(observations, actions, rewards, next_observations, dones)
+        if dones.any():
+            episodes += int(np.count_nonzero(dones))
+            best_score = max(best_score, int(info["scores"][dones].max()))
+        observations = next_observations
+    return {"frames": num_steps * env.num_envs * env.frames_per_step, "episodes": episodes, "best_score": best_score}
+
+
+# What the learner shows a renderer: a copy of the game being played, of the
+# Q table, and training progress
+Snapshot = namedtuple("Snapshot", ["simulation", "q", "frames", "episodes", "best_score"])
+
+
+# Runs train() style learning unthrottled in a background thread. The thread
+# never waits for a renderer: it only builds a Snapshot when one has been
+# asked for with request_snapshot(), so copying the Q table costs it at most
+# once per displayed frame, and a renderer that falls behind simply gets the
+# newest state the next time it asks.
+class TrainingThread(threading.Thread):
+    def __init__(self, agent, simulation):
+        super().__init__(daemon=True)
+        self.agent = agent
+        self.simulation = simulation
+        self.snapshot = None
+        self.snapshot_wanted = threading.Event()
+        self.running = True
+        self.frames = 0
+        self.episodes = 0
+        self.best_score = 0
+
+    def request_snapshot(self):
+        self.snapshot_wanted.set()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        agent = self.agent
+        simulation = self.simulation
+        # ActionRepeat wraps the game that gets drawn
+        game = getattr(simulation, "env", simulation)
+        observation = simulation.reset()
+        episode_frames = 0
+        while self.running:
+            action = agent.choose(observation)
+            next_observation, reward, done, info = simulation.step(action)
+            agent.learn(observation, action, reward, next_observation, done)
+            self.frames += info["frames"] - episode_frames
+            episode_frames = info["frames"]
+            if done:
+                self.episodes += 1
+                self.best_score = max(self.best_score, info["score"])
+                episode_frames = 0
+                observation = simulation.reset()
+            else:
+                observation = next_observation
+
+            if self.snapshot_wanted.is_set():
+                self.snapshot_wanted.clear()
+                self.snapshot = Snapshot(copy.copy(game), agent.q.copy(), self.frames, self.episodes,
+                                         self.best_score)
@@ -1,166 +1,168 @@
 #!/usr/bin/env python
 
+import argparse
+import time
 import pygame
 from pygame.locals import *  # noqa
 import sys
-import random
-from enum import Enum
 
-
-class Actions(Enum):
-    CLICK = 0,
-    DO_NOTHING = 1
+from action_repeat import ActionRepeat
+from agent import QAgent, TrainingThread
+from simulation import ACTIONS, Actions, FlappySimulation, GAP, SCREEN_HEIGHT, SCREEN_WIDTH
 
 
 class FlappyBird:
     def __init__(self, alpha=0.3, gamma=0.9, debug=True):
-        self.screen = pygame.display.set_mode((400, 708))
-        self.bird = pygame.Rect(65, 50, 50, 50)
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.background = pygame.image.load("assets/background.png").convert()
         self.birdSprites = [pygame.image.load("assets/1.png").convert_alpha(),
                             pygame.image.load("assets/2.png").convert_alpha(),
                             pygame.image.load("assets/dead.png")]
         self.wallUp = pygame.image.load("assets/bottom.png").convert_alpha()
         self.wallDown = pygame.image.load("assets/top.png").convert_alpha()
-        self.gap = 130
-        self.wallx = 400
-        self.birdY = 350
-        self.jump = 0
-        self.jumpSpeed = 10
-        self.gravity = 5
-        self.dead = False
         self.sprite = 0
-        self.counter = 0
-        self.offset = random.randint(-110, 110)
-        self.q = {}
-        self.debug=True
-        self.alpha = alpha
-        self.gamma = gamma
-        self.horizontal_dist_dash = 99999
-        self.vertical_dist_hash = 99999
-        self.action_to_perform = random.choice([Actions.CLICK, Actions.DO_NOTHING])
-
-    def updateWalls(self):
-        self.wallx -= 2
-        if self.wallx < -80:
-            self.wallx = 400
-            self.counter += 1
-            self.offset = random.randint(-110, 110)
-
-    def getQ(self, state):
-        return self.q.get(state, 0.0)
-
-    def birdUpdate(self):
-        if self.jump:
-            self.jumpSpeed -= 1
-            self.birdY -= self.jumpSpeed
-            self.jump -= 1
-        else:
-            self.birdY += self.gravity
-            self.gravity += 0.2
-        self.bird[1] = self.birdY
-        upRect = pygame.Rect(self.wallx,
-                             360 + self.gap - self.offset + 10,
-                             self.wallUp.get_width() - 10,
-                             self.wallUp.get_height())
-        downRect = pygame.Rect(self.wallx,
-                               0 - self.gap - self.offset - 10,
-                               self.wallDown.get_width() - 10,
-                               self.wallDown.get_height())
-
-        if upRect.colliderect(self.bird):
-            self.dead = True
-        if downRect.colliderect(self.bird):
-            self.dead = True
-        if not 0 < self.bird[1] < 720:
-            self.bird[1] = 50
-            self.birdY = 50
-            self.dead = False
-            self.counter = 0
-            self.wallx = 400
-            self.offset = random.randint(-110, 110)
-            self.gravity = 5
+        self.debug = debug
+        # Physics and learning run without pygame, this class only draws them
+        self.simulation = FlappySimulation()
+        self.agent = QAgent(alpha, gamma)
+
+    def birdUpdate(self, simulation, observation, pause=True):
+        bird = pygame.Rect(simulation.bird_rect())
+        upRect = pygame.Rect(simulation.up_rect())
+        downRect = pygame.Rect(simulation.down_rect())
 
         if self.debug:
             border_color = (255, 0, 0)
             blue_color = (0, 0, 255)
 
             # Draw the horizontal line
-            pygame.draw.lines(self.screen, border_color, False, [(self.bird[0] + self.bird[2], self.bird[1] + self.bird[3]),
-                                                                 (self.wallx, self.bird[1] + self.bird[3])], 2)
+            pygame.draw.lines(self.screen, border_color, False, [(bird[0] + bird[2], bird[1] + bird[3]),
+                                                                 (simulation.wallx, bird[1] + bird[3])], 2)
 
             # Draw the vertical line
-            pygame.draw.lines(self.screen, border_color, False, [(self.bird[0] + self.bird[2], self.bird[1] + self.bird[3]),
-                                                                 (self.bird[0] + self.bird[2], 360 + self.gap - self.offset + 10)], 2)
+            pygame.draw.lines(self.screen, border_color, False, [(bird[0] + bird[2], bird[1] + bird[3]),
+                                                                 (bird[0] + bird[2], 360 + GAP - simulation.offset + 10)], 2)
 
-            horizontal_dist = min(0, self.wallx - (self.bird[0] + self.bird[2]))
-            vertical_dist = min(0, (360 + self.gap - self.offset + 10) - (self.bird[1] + self.bird[3]))
+            if pause:
+                print("Horizontal Dist: %s --- Vertical Dist: %s" % observation)
+                input()
 
-            print("Horizontal Dist: %s --- Vertical Dist: %s" % (horizontal_dist, vertical_dist))
-            input()
+            pygame.draw.rect(self.screen, blue_color, bird, 2)
+            pygame.draw.rect(self.screen, border_color, upRect, 2)
+            pygame.draw.rect(self.screen, border_color, downRect, 2)
 
-            # Q[s,a] ← Q[s,a] + α (r + γ * V(s') - Q[s,a])
-            v_dash_do_nothing = self.getQ((self.horizontal_dist_dash, self.vertical_dist_hash, Actions.DO_NOTHING))
-            v_dash_click = self.getQ((self.horizontal_dist_dash, self.vertical_dist_hash, Actions.CLICK))
-            v_dash = max(v_dash_click, v_dash_do_nothing)
+        self.screen.blit(self.birdSprites[self.sprite], (70, simulation.birdY))
+
+    def draw(self, simulation, observation, font, pause=True):
+        self.screen.fill((255, 255, 255))
+        self.screen.blit(self.background, (0, 0))
+        self.screen.blit(self.wallUp,
+                         (simulation.wallx, 360 + GAP - simulation.offset))
+        self.screen.blit(self.wallDown,
+                         (simulation.wallx, 0 - GAP - simulation.offset))
+        self.screen.blit(font.render(str(simulation.counter),
+                                     -1,
+                                     (255, 255, 255)),
+                         (200, 50))
+        if simulation.dead:
+            self.sprite = 2
+        elif simulation.jump:
+            self.sprite = 1
+        if not simulation.dead:
+            self.sprite = 0
+        self.birdUpdate(simulation, observation, pause)
 
-            current_state = (horizontal_dist, vertical_dist, self.action_to_perform)
-            reward = 1 if self.dead is False else -1000
+    def run(self):
+        clock = pygame.time.Clock()
+        pygame.font.init()
+        font = pygame.font.SysFont("Arial", 50)
+        simulation = self.simulation
+        observation = simulation.reset()
+        while True:
+            clock.tick(60)
+            next_action = self.agent.choose(observation)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    sys.exit()
+                if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+                    next_action = Actions.CLICK
 
-            original = self.getQ(current_state)
-            self.q[current_state] = original + self.alpha * (reward + self.gamma * v_dash - original)
-            print("Current State: %s   --> Q Value: %s" % (current_state, self.q[current_state]))
+            next_observation, reward, done, info = simulation.step(next_action)
+            q_value = self.agent.learn(observation, next_action, reward, next_observation, done)
+            if self.debug:
+                print("Current State: %s   --> Q Value: %s" % ((observation[0], observation[1], next_action), q_value))
 
-            pygame.draw.rect(self.screen, blue_color, self.bird, 2)
-            pygame.draw.rect(self.screen, border_color, upRect, 2)
-            pygame.draw.rect(self.screen, border_color, downRect, 2)
-            self.screen.blit(self.birdSprites[self.sprite], (70, self.birdY))
+            self.draw(simulation, next_observation, font)
 
-            click_action = self.getQ((horizontal_dist, vertical_dist, Actions.CLICK))
-            do_nothing_action = self.getQ((horizontal_dist, vertical_dist, Actions.DO_NOTHING))
+            pygame.display.update()
 
-            if click_action > do_nothing_action:
-                return Actions.CLICK
+            if done:
+                observation = simulation.reset()
             else:
-                return Actions.DO_NOTHING
+                observation = next_observation
+
+    def watch_training(self, action_repeat=1, fps=60):
+        # Learning runs at full speed in a TrainingThread on its own game,
+        # this loop only draws the latest snapshot of it fps times a second
+        # and never pauses or prints per frame
+        simulation = FlappySimulation()
+        if action_repeat > 1:
+            simulation = ActionRepeat(simulation, action_repeat)
+        learner = TrainingThread(self.agent, simulation)
+        learner.start()
 
-    def run(self):
         clock = pygame.time.Clock()
         pygame.font.init()
         font = pygame.font.SysFont("Arial", 50)
-        next_action = random.choice([Actions.CLICK, Actions.DO_NOTHING])
+        small_font = pygame.font.SysFont("Arial", 16)
+        last_frames = 0
+        last_time = time.perf_counter()
+        frames_per_sec = 0.0
         while True:
-            clock.tick(60)
+            clock.tick(fps)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    learner.stop()
+                    learner.join()
                     sys.exit()
-                if (event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN or next_action == Actions.CLICK) and not self.dead:
-                    self.jump = 17
-                    self.gravity = 5
-                    self.jumpSpeed = 10
-
-            self.screen.fill((255, 255, 255))
-            self.screen.blit(self.background, (0, 0))
-            self.screen.blit(self.wallUp,
-                             (self.wallx, 360 + self.gap - self.offset))
-            self.screen.blit(self.wallDown,
-                             (self.wallx, 0 - self.gap - self.offset))
-            self.screen.blit(font.render(str(self.counter),
-                                         -1,
-                                         (255, 255, 255)),
-                             (200, 50))
-            if self.dead:
-                self.sprite = 2
-            elif self.jump:
-                self.sprite = 1
-            if not self.dead:
-                self.sprite = 0
-            self.updateWalls()
-            next_action = self.birdUpdate()
-            for k, v in self.q.items():
-                print(k, v)
 
+            snapshot = learner.snapshot
+            learner.request_snapshot()
+            if snapshot is None:
+                continue
+
+            now = time.perf_counter()
+            if now - last_time >= 1.0:
+                frames_per_sec = (snapshot.frames - last_frames) / (now - last_time)
+                last_frames = snapshot.frames
+                last_time = now
+
+            game = snapshot.simulation
+            observation = game.observation()
+            self.draw(game, observation, font, pause=False)
+            h, v = self.agent.discretizer.bucket(*observation)
+            lines = ["Frames: %d (%.0f/sec)" % (snapshot.frames, frames_per_sec),
+                     "Episodes: %d  Best: %d" % (snapshot.episodes, snapshot.best_score),
+                     "Q click: %.1f  nothing: %.1f" % (snapshot.q[h, v, ACTIONS.index(Actions.CLICK)],
+                                                       snapshot.q[h, v, ACTIONS.index(Actions.DO_NOTHING)])]
+            for i, line in enumerate(lines):
+                self.screen.blit(small_font.render(line, True, (255, 255, 255)), (10, 10 + 20 * i))
             pygame.display.update()
 
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watch-training", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--no-debug", dest="debug", action="store_false")
+    args = parser.parse_args()
+    flappy_bird = FlappyBird(debug=args.debug)
+    if args.watch_training:
+        flappy_bird.watch_training(args.repeat, args.fps)
+    else:
+        flappy_bird.run()
+
+
 if __name__ == "__main__":
-    FlappyBird().run()
+    main()
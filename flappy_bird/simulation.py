@@ -0,0 +1,125 @@
+import random
+from enum import Enum
+
+
+class Actions(Enum):
+    CLICK = 0,
+    DO_NOTHING = 1
+
+
+# Array encodings of an action are indexes into this list. DO_NOTHING comes
+# first so that an argmax over equal Q values does not click.
+ACTIONS = [Actions.DO_NOTHING, Actions.CLICK]
+CLICK = ACTIONS.index(Actions.CLICK)
+DO_NOTHING = ACTIONS.index(Actions.DO_NOTHING)
+
+
+# Game geometry, matching the sprites in assets/
+SCREEN_WIDTH = 400
+SCREEN_HEIGHT = 708
+FLOOR = 720
+BIRD_X = 65
+BIRD_SIZE = 50
+GAP = 130
+WALL_UP_WIDTH = 98
+WALL_UP_HEIGHT = 500
+WALL_DOWN_WIDTH = 100
+WALL_DOWN_HEIGHT = 500
+OFFSET_RANGE = 110
+
+# Physics, per frame
+WALL_SPEED = 2
+WALL_RESET = -80
+JUMP_FRAMES = 17
+JUMP_SPEED = 10
+GRAVITY = 5
+GRAVITY_STEP = 0.2
+
+ALIVE_REWARD = 1
+DEAD_REWARD = -1000
+
+
+def collide(a, b):
+    # Same test as pygame.Rect.colliderect on (x, y, w, h) tuples of ints:
+    # empty rectangles never collide and touching edges do not overlap
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    if aw == 0 or ah == 0 or bw == 0 or bh == 0:
+        return False
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+# The FlappyBird game without pygame: the physics of a frame, collisions and
+# rewards behind a reset() / step(action) API, so training can run as fast as
+# the interpreter allows on machines without a display.
+class FlappySimulation:
+    # Physics frames advanced by one step()
+    frames_per_step = 1
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.wallx = SCREEN_WIDTH
+        self.birdY = 350
+        self.jump = 0
+        self.jumpSpeed = JUMP_SPEED
+        self.gravity = GRAVITY
+        self.dead = False
+        self.counter = 0
+        self.frames = 0
+        self.offset = self.random.randint(-OFFSET_RANGE, OFFSET_RANGE)
+        return self.observation()
+
+    def bird_rect(self):
+        # pygame truncates rect coordinates to ints
+        return (BIRD_X, int(self.birdY), BIRD_SIZE, BIRD_SIZE)
+
+    def up_rect(self):
+        return (self.wallx, 360 + GAP - self.offset + 10, WALL_UP_WIDTH - 10, WALL_UP_HEIGHT)
+
+    def down_rect(self):
+        return (self.wallx, 0 - GAP - self.offset - 10, WALL_DOWN_WIDTH - 10, WALL_DOWN_HEIGHT)
+
+    def observation(self):
+        # Horizontal distance from the front of the bird to the pipe, and
+        # vertical distance from the bottom of the bird to the lower pipe
+        x, y, w, h = self.bird_rect()
+        return (self.wallx - (x + w), (360 + GAP - self.offset + 10) - (y + h))
+
+    def update_walls(self):
+        self.wallx -= WALL_SPEED
+        if self.wallx < WALL_RESET:
+            self.wallx = SCREEN_WIDTH
+            self.counter += 1
+            self.offset = self.random.randint(-OFFSET_RANGE, OFFSET_RANGE)
+
+    def step(self, action):
+        # One frame. Returns (observation, reward, done, info); the episode is
+        # over once the bird hits a pipe or leaves the screen, after which
+        # reset() has to be called.
+        if action == Actions.CLICK and not self.dead:
+            self.jump = JUMP_FRAMES
+            self.gravity = GRAVITY
+            self.jumpSpeed = JUMP_SPEED
+
+        self.update_walls()
+
+        if self.jump:
+            self.jumpSpeed -= 1
+            self.birdY -= self.jumpSpeed
+            self.jump -= 1
+        else:
+            self.birdY += self.gravity
+            self.gravity += GRAVITY_STEP
+        self.frames += 1
+
+        bird = self.bird_rect()
+        if collide(self.up_rect(), bird) or collide(self.down_rect(), bird):
+            self.dead = True
+        if not 0 < bird[1] < FLOOR:
+            self.dead = True
+
+        reward = ALIVE_REWARD if not self.dead else DEAD_REWARD
+        return self.observation(), reward, self.dead, {"score": self.counter, "frames": self.frames}
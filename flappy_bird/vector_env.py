@@ -0,0 +1,140 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from simulation import (ACTIONS, ALIVE_REWARD, BIRD_SIZE, BIRD_X, CLICK, DEAD_REWARD, FLOOR, GAP, GRAVITY,
+                        GRAVITY_STEP, JUMP_FRAMES, JUMP_SPEED, OFFSET_RANGE, SCREEN_WIDTH, WALL_DOWN_HEIGHT,
+                        WALL_DOWN_WIDTH, WALL_RESET, WALL_SPEED, WALL_UP_HEIGHT, WALL_UP_WIDTH, FlappySimulation)
+
+
+def collide_many(ax, ay, aw, ah, bx, by, bw, bh):
+    # collide() for arrays of rectangles, element by element
+    nonempty = (aw != 0) & (ah != 0) & (bw != 0) & (bh != 0)
+    return nonempty & (ax < bx + bw) & (bx < ax + aw) & (ay < by + bh) & (by < ay + ah)
+
+
+# N independent FlappySimulation games stepped together. The state of every
+# game lives in arrays and a step is a handful of array operations, so the
+# cost of a frame is nearly independent of N. Actions are given as indexes
+# into simulation.ACTIONS and games that end are reset on the spot.
+class VectorFlappyEnv:
+    frames_per_step = 1
+
+    def __init__(self, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.wallx = np.zeros(num_envs, dtype=np.int64)
+        self.birdY = np.zeros(num_envs)
+        self.jump = np.zeros(num_envs, dtype=np.int64)
+        self.jumpSpeed = np.zeros(num_envs, dtype=np.int64)
+        self.gravity = np.zeros(num_envs)
+        self.offset = np.zeros(num_envs, dtype=np.int64)
+        self.counter = np.zeros(num_envs, dtype=np.int64)
+        self.frames = np.zeros(num_envs, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self._reset(np.ones(self.num_envs, dtype=bool))
+        return self.observation()
+
+    def _reset(self, mask):
+        count = int(np.count_nonzero(mask))
+        if count == 0:
+            return
+        self.wallx[mask] = SCREEN_WIDTH
+        self.birdY[mask] = 350
+        self.jump[mask] = 0
+        self.jumpSpeed[mask] = JUMP_SPEED
+        self.gravity[mask] = GRAVITY
+        self.counter[mask] = 0
+        self.frames[mask] = 0
+        self.offset[mask] = self.rng.integers(-OFFSET_RANGE, OFFSET_RANGE + 1, count)
+
+    def bird_y(self):
+        # Same truncation towards zero as the int() in FlappySimulation
+        return self.birdY.astype(np.int64)
+
+    def observation(self):
+        # Arrays of the horizontal and vertical distances, see
+        # FlappySimulation.observation
+        return (self.wallx - (BIRD_X + BIRD_SIZE),
+                (360 + GAP - self.offset + 10) - (self.bird_y() + BIRD_SIZE))
+
+    def step(self, actions):
+        # One frame of every game. Returns (observations, rewards, dones,
+        # info) where the observations of finished games are already those of
+        # their next game, and info holds the scores and frame counts the
+        # games had before any reset.
+        click = np.asarray(actions) == CLICK
+        self.jump[click] = JUMP_FRAMES
+        self.gravity[click] = GRAVITY
+        self.jumpSpeed[click] = JUMP_SPEED
+
+        self.wallx -= WALL_SPEED
+        passed = self.wallx < WALL_RESET
+        num_passed = int(np.count_nonzero(passed))
+        if num_passed > 0:
+            self.wallx[passed] = SCREEN_WIDTH
+            self.counter[passed] += 1
+            self.offset[passed] = self.rng.integers(-OFFSET_RANGE, OFFSET_RANGE + 1, num_passed)
+
+        jumping = self.jump > 0
+        falling = ~jumping
+        self.jumpSpeed[jumping] -= 1
+        self.birdY[jumping] -= self.jumpSpeed[jumping]
+        self.jump[jumping] -= 1
+        self.birdY[falling] += self.gravity[falling]
+        self.gravity[falling] += GRAVITY_STEP
+        self.frames += 1
+
+        bird_y = self.bird_y()
+        dead = collide_many(self.wallx, 360 + GAP - self.offset + 10, WALL_UP_WIDTH - 10, WALL_UP_HEIGHT,
+                            BIRD_X, bird_y, BIRD_SIZE, BIRD_SIZE)
+        dead |= collide_many(self.wallx, 0 - GAP - self.offset - 10, WALL_DOWN_WIDTH - 10, WALL_DOWN_HEIGHT,
+                             BIRD_X, bird_y, BIRD_SIZE, BIRD_SIZE)
+        dead |= (bird_y <= 0) | (bird_y >= FLOOR)
+
+        rewards = np.where(dead, DEAD_REWARD, ALIVE_REWARD)
+        info = {"scores": self.counter.copy(), "frames": self.frames.copy()}
+        self._reset(dead)
+        return self.observation(), rewards, dead, info
+
+
+def benchmark(num_birds=1024, num_frames=200000, seed=0):
+    # Frames per second of random play, one FlappySimulation against a
+    # VectorFlappyEnv of num_birds games
+    rng = random.Random(seed)
+    simulation = FlappySimulation(seed)
+    start_time = time.perf_counter()
+    for frame in range(0, num_frames):
+        observation, reward, done, info = simulation.step(rng.choice(ACTIONS))
+        if done:
+            simulation.reset()
+    scalar_fps = num_frames / (time.perf_counter() - start_time)
+
+    env = VectorFlappyEnv(num_birds, seed)
+    actions_rng = np.random.default_rng(seed)
+    num_steps = max(1, num_frames // num_birds)
+    start_time = time.perf_counter()
+    for step in range(0, num_steps):
+        env.step(actions_rng.integers(0, len(ACTIONS), num_birds))
+    vector_fps = num_steps * num_birds / (time.perf_counter() - start_time)
+
+    print("FlappySimulation: %12.0f frames/sec" % scalar_fps)
+    print("VectorFlappyEnv:  %12.0f frames/sec (%d birds, %.1fx)" % (vector_fps, num_birds, vector_fps / scalar_fps))
+    return {"scalar_fps": scalar_fps, "vector_fps": vector_fps}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--birds", type=int, default=1024)
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.birds, args.frames, args.seed)
+
+
+if __name__ == "__main__":
+    main()
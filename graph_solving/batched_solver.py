@@ -0,0 +1,222 @@
+import argparse
+import time
+
+import numpy as np
+
+from qlearnsolver import GOAL_REWARD
+
+
+# Many small independent problems of the kind main() solves one at a time,
+# stacked into [K, N, N] adjacency, reward and Q tensors and trained together.
+# Every instance has its own random graph, start and goal, and its own random
+# walker; all walkers take their steps in lock-step.
+class BatchedQLearnSolver:
+    def __init__(self, num_instances, num_nodes, gamma=0.3, seed=None):
+        self.num_instances = num_instances
+        self.num_nodes = num_nodes
+        self.gamma = gamma
+        self.rng = np.random.default_rng(seed)
+        self.training_episodes = 0
+
+        K, N = num_instances, num_nodes
+        instances = np.arange(K)
+        self.starts = self.rng.integers(0, N, K)
+        self.goals = (self.starts + self.rng.integers(1, N, K)) % N
+
+        # Same graph distribution as random_adjacency, for all instances at
+        # once: the first candidate edge between a pair of nodes wins.
+        n1 = self.rng.integers(0, N, (K, N))
+        n2 = self.rng.integers(0, N, (K, N))
+        k = np.repeat(instances, N)
+        n1 = n1.ravel()
+        n2 = n2.ravel()
+        keep = n1 != n2
+        k, n1, n2 = k[keep], n1[keep], n2[keep]
+        pair = (k * N + np.minimum(n1, n2)) * N + np.maximum(n1, n2)
+        pair, first = np.unique(pair, return_index=True)
+
+        self.adjacency = np.zeros((K, N, N), dtype=bool)
+        self.adjacency[k[first], n1[first], n2[first]] = True
+
+        # Make sure there is atleast one edge between the start and goal
+        self.adjacency[instances, self.goals, self.starts] = False
+        self.adjacency[instances, self.starts, self.goals] = True
+
+        self.reward_matrix = np.where(self.adjacency & (np.arange(N) == self.goals[:, None, None]),
+                                      float(GOAL_REWARD), 0.0)
+        self.Q = np.zeros((K, N, N))
+
+    def next_state_values(self, instances, next_states):
+        values = np.where(self.adjacency[instances, next_states], self.Q[instances, next_states], 0)
+        # Episodes end at the goal, so nothing is earned past it
+        return np.where(next_states == self.goals[instances], 0, np.maximum(values.max(axis=1), 0))
+
+    def execute_training(self, instances=None):
+        # One episode for each of the given instances (all by default).
+        # Returns the largest Q change of every one of them.
+        if instances is None:
+            instances = np.arange(self.num_instances)
+        current = self.starts[instances]
+        visited = np.zeros((len(instances), self.num_nodes), dtype=bool)
+        visited[np.arange(len(instances)), current] = True
+        max_delta = np.zeros(len(instances))
+        # Positions into instances of the walkers still moving
+        active = np.arange(len(instances))
+
+        while len(active) > 0:
+            walkers = instances[active]
+            free = self.adjacency[walkers, current[active]] & ~visited[active]
+
+            # Walkers at a dead end or with every neighbor visited are done
+            moving = free.any(axis=1)
+            active = active[moving]
+            walkers = walkers[moving]
+            free = free[moving]
+            if len(active) == 0:
+                break
+
+            # Uniform choice among the free neighbors
+            draws = np.where(free, self.rng.random(free.shape), -1)
+            next_states = draws.argmax(axis=1)
+            states = current[active]
+
+            targets = self.reward_matrix[walkers, states, next_states] + \
+                self.gamma * self.next_state_values(walkers, next_states)
+            max_delta[active] = np.maximum(max_delta[active], np.abs(targets - self.Q[walkers, states, next_states]))
+            self.Q[walkers, states, next_states] = targets
+
+            current[active] = next_states
+            visited[active, next_states] = True
+            active = active[next_states != self.goals[walkers]]
+
+        return max_delta
+
+    def train(self, num_episodes=10000, window=None, tolerance=1e-9):
+        # With a window, an instance stops training once none of its Q values
+        # changed for that many consecutive episodes, like main() does for a
+        # single problem. Returns the episodes used by every instance.
+        start_time = time.time()
+        episodes = np.zeros(self.num_instances, dtype=np.int64)
+        quiet_episodes = np.zeros(self.num_instances, dtype=np.int64)
+        training = np.arange(self.num_instances)
+
+        for episode in range(0, num_episodes):
+            if len(training) == 0:
+                break
+            max_delta = self.execute_training(training)
+            episodes[training] += 1
+            if window is not None:
+                quiet_episodes[training] = np.where(max_delta > tolerance, 0, quiet_episodes[training] + 1)
+                training = training[quiet_episodes[training] < window]
+
+        self.training_episodes += int(episodes.max()) if self.num_instances > 0 else 0
+        elapsed = time.time() - start_time
+        return {
+            "episodes": episodes,
+            "instances": self.num_instances,
+            "seconds": elapsed,
+            "instances_per_minute": self.num_instances / elapsed * 60 if elapsed > 0 else float("inf"),
+        }
+
+    def execute_value_iteration(self, tolerance=1e-6, max_sweeps=1000):
+        # Synchronous Bellman sweeps over every edge of every instance, the
+        # batched counterpart of QLearnSolver.execute_value_iteration
+        start_time = time.time()
+        instances = np.arange(self.num_instances)
+        sweeps = 0
+        residual = 0.0
+        while sweeps < max_sweeps:
+            V = np.maximum(np.where(self.adjacency, self.Q, 0).max(axis=2), 0)
+            # Episodes end at the goal, so nothing is earned past it
+            V[instances, self.goals] = 0
+            new_Q = np.where(self.adjacency, self.reward_matrix + self.gamma * V[:, None, :], 0)
+            residual = float(np.abs(new_Q - self.Q).max()) if self.Q.size > 0 else 0.0
+            self.Q = new_Q
+            sweeps += 1
+            if residual < tolerance:
+                break
+
+        elapsed = time.time() - start_time
+        return {
+            "sweeps": sweeps,
+            "residual": residual,
+            "converged": residual < tolerance,
+            "instances": self.num_instances,
+            "seconds": elapsed,
+            "instances_per_minute": self.num_instances / elapsed * 60 if elapsed > 0 else float("inf"),
+        }
+
+    def execute(self):
+        # Greedy path of every instance: the first neighbor with the largest
+        # positive Q value, or the first neighbor if none is positive.
+        K, N = self.num_instances, self.num_nodes
+        paths = [[start] for start in self.starts.tolist()]
+        visited = np.zeros((K, N), dtype=bool)
+        current = self.starts.copy()
+        visited[np.arange(K), current] = True
+        active = np.flatnonzero(current != self.goals)
+
+        for step in range(0, N):
+            if len(active) == 0:
+                break
+            neighbors = self.adjacency[active, current[active]]
+            active = active[neighbors.any(axis=1)]
+            neighbors = neighbors[neighbors.any(axis=1)]
+
+            values = np.where(neighbors, self.Q[active, current[active]], -1)
+            next_states = np.where(values.max(axis=1) > 0, values.argmax(axis=1), neighbors.argmax(axis=1))
+
+            # Stop instead of walking into a cycle
+            fresh = ~visited[active, next_states]
+            active = active[fresh]
+            next_states = next_states[fresh]
+            for instance, next_state in zip(active.tolist(), next_states.tolist()):
+                paths[instance].append(next_state)
+
+            current[active] = next_states
+            visited[active, next_states] = True
+            active = active[next_states != self.goals[active]]
+
+        return paths
+
+    def report(self, verbose=False):
+        # Same check main() applies to every problem: the path has to go
+        # straight from start to goal.
+        paths = self.execute()
+        passed = np.array([path[0] == start and path[-1] == goal and len(path) <= 2
+                           for path, start, goal in zip(paths, self.starts.tolist(), self.goals.tolist())])
+        if verbose:
+            for instance in np.flatnonzero(~passed).tolist():
+                print("Error in predicting.... Instance: %s Start: %s End: %s Found path: %s" %
+                      (instance, self.starts[instance], self.goals[instance], paths[instance]))
+                print("Q = ")
+                for row in self.Q[instance]:
+                    print(" ".join(str(j) for j in row))
+        return {"paths": paths, "passed": passed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=2000)
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=10000)
+    parser.add_argument("--window", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["random_walk", "value_iteration"], default="random_walk")
+    args = parser.parse_args()
+
+    solver = BatchedQLearnSolver(args.instances, args.nodes, seed=args.seed)
+    if args.engine == "value_iteration":
+        stats = solver.execute_value_iteration()
+        work = "Sweeps: %s" % stats["sweeps"]
+    else:
+        stats = solver.train(args.episodes, args.window)
+        work = "Episodes: %s" % stats["episodes"].sum()
+    result = solver.report(verbose=True)
+    print("Passed: %s Failed: %s %s Time: %.2fs Instances/minute: %.0f" %
+          (result["passed"].sum(), (~result["passed"]).sum(), work, stats["seconds"],
+           stats["instances_per_minute"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+import struct
+
+import numpy as np
+
+# Layout of a checkpoint file:
+#
+#   magic      8 bytes   b"QLCKPT\0\0"
+#   version    uint32    little endian
+#   length     uint32    little endian, length of the header
+#   header     JSON      user fields plus the dtype, shape and offset of every array
+#   arrays     raw little endian buffers, each aligned to ALIGNMENT bytes
+#
+# Keeping the arrays as raw aligned buffers lets them be memory mapped instead
+# of read and unpickled.
+MAGIC = b"QLCKPT\0\0"
+VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_checkpoint(path, header, arrays):
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder("<"))
+              for name, array in arrays.items()}
+
+    # The offsets depend on the header length, which depends on the offsets,
+    # so grow the start of the data until the header fits in front of it.
+    layout = {name: {"dtype": array.dtype.str, "shape": list(array.shape), "offset": 0}
+              for name, array in arrays.items()}
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, array in arrays.items():
+            layout[name]["offset"] = offset
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(dict(header, arrays=layout)).encode("utf-8")
+        needed = _align(_PREAMBLE.size + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    with open(path, "wb") as output:
+        output.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        output.write(header_bytes)
+        for name, array in arrays.items():
+            output.seek(layout[name]["offset"])
+            output.write(array.tobytes())
+        output.truncate(offset)
+
+
+def read_checkpoint(path, mmap=True):
+    # Returns the header and the arrays. With mmap the arrays are copy on
+    # write views of the file, so they can be modified without touching it.
+    with open(path, "rb") as input:
+        magic, version, length = _PREAMBLE.unpack(input.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a checkpoint file" % path)
+        if version > VERSION:
+            raise ValueError("Unsupported checkpoint version %s (newest supported is %s)" % (version, VERSION))
+        header = json.loads(input.read(length).decode("utf-8"))
+
+        arrays = {}
+        for name, entry in header.pop("arrays").items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            count = int(np.prod(shape))
+            if count == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="c", offset=entry["offset"], shape=shape)
+            else:
+                input.seek(entry["offset"])
+                arrays[name] = np.fromfile(input, dtype=dtype, count=count).reshape(shape)
+
+    return header, arrays
@@ -0,0 +1,136 @@
+import numpy as np
+
+
+# Square sparse matrix in compressed sparse row layout. Row u holds the
+# out-edges of node u: the target nodes are indices[indptr[u]:indptr[u + 1]]
+# (sorted) and data holds one value per edge, aligned with indices.
+class CSRMatrix:
+    def __init__(self, num_rows, indptr, indices, data=None):
+        self.num_rows = num_rows
+        self.indptr = indptr
+        self.indices = indices
+        if data is None:
+            data = np.zeros(len(indices))
+        self.data = data
+        self._keys = None
+        self._row_ids = None
+
+    @classmethod
+    def from_edges(cls, num_rows, rows, cols, data=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        order = np.lexsort((cols, rows))
+
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+
+        if data is not None:
+            data = np.asarray(data, dtype=np.float64)[order]
+
+        return cls(num_rows, indptr, cols[order], data)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def degree(self, row):
+        return self.indptr[row + 1] - self.indptr[row]
+
+    def neighbors(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def row_data(self, row):
+        return self.data[self.indptr[row]:self.indptr[row + 1]]
+
+    def row_ids(self):
+        # Source node of every edge, aligned with indices
+        if self._row_ids is None:
+            self._row_ids = np.repeat(np.arange(self.num_rows, dtype=np.int64), np.diff(self.indptr))
+        return self._row_ids
+
+    def gather_rows(self, rows):
+        # Edge ids of all the out-edges of the given rows, concatenated in
+        # order, along with how many of them belong to each row.
+        starts = self.indptr[rows]
+        counts = self.indptr[np.asarray(rows) + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        edge_ids = np.arange(counts.sum(), dtype=np.int64) + np.repeat(starts - offsets, counts)
+        return edge_ids, counts
+
+    def edges(self):
+        return zip(self.row_ids().tolist(), self.indices.tolist())
+
+    def find(self, row, col):
+        lo = self.indptr[row]
+        hi = self.indptr[row + 1]
+        pos = lo + np.searchsorted(self.indices[lo:hi], col)
+        if pos < hi and self.indices[pos] == col:
+            return pos
+        return -1
+
+    def find_edges(self, rows, cols):
+        # Vectorized find(). Every (row, col) pair maps to a unique key and
+        # the keys are sorted because the rows and the columns within a row are.
+        if self._keys is None:
+            self._keys = self.row_ids() * self.num_rows + self.indices
+        keys = np.asarray(rows, dtype=np.int64) * self.num_rows + np.asarray(cols, dtype=np.int64)
+        pos = np.searchsorted(self._keys, keys)
+        pos[pos == len(self._keys)] = 0
+        found = self._keys[pos] == keys if len(self._keys) > 0 else np.zeros(len(keys), dtype=bool)
+        return np.where(found, pos, -1)
+
+    def transpose(self):
+        return CSRMatrix.from_edges(self.num_rows, self.indices, self.row_ids(), self.data)
+
+    def insert(self, row, col, value=0.0):
+        # Adds the edge row -> col keeping the columns of the row sorted and
+        # returns its position. Positions after it shift up by one.
+        lo = self.indptr[row]
+        hi = self.indptr[row + 1]
+        pos = lo + np.searchsorted(self.indices[lo:hi], col)
+        if pos < hi and self.indices[pos] == col:
+            raise KeyError("Edge %s -> %s already exists" % (row, col))
+        self.indices = np.insert(self.indices, pos, col)
+        self.data = np.insert(self.data, pos, value)
+        self.indptr[row + 1:] += 1
+        self._keys = None
+        self._row_ids = None
+        return pos
+
+    def remove(self, row, col):
+        # Removes the edge row -> col and returns the position it had.
+        # Positions after it shift down by one.
+        pos = self.find(row, col)
+        if pos < 0:
+            raise KeyError("No edge %s -> %s" % (row, col))
+        self.indices = np.delete(self.indices, pos)
+        self.data = np.delete(self.data, pos)
+        self.indptr[row + 1:] -= 1
+        self._keys = None
+        self._row_ids = None
+        return pos
+
+    def __getitem__(self, key):
+        row, col = key
+        pos = self.find(row, col)
+        if pos < 0:
+            return 0.0
+        return self.data[pos]
+
+    def __setitem__(self, key, value):
+        row, col = key
+        pos = self.find(row, col)
+        if pos < 0:
+            raise KeyError("No edge %s -> %s" % (row, col))
+        self.data[pos] = value
+
+
+def segment_max(values, counts, initial=0):
+    # Max over consecutive runs of values with the given lengths. Empty runs
+    # and runs whose max is below initial produce initial.
+    result = np.full(len(counts), initial, dtype=np.float64)
+    nonempty = counts > 0
+    if len(values) > 0:
+        offsets = (np.cumsum(counts) - counts)[nonempty]
+        result[nonempty] = np.maximum(np.maximum.reduceat(values, offsets), initial)
+    return result
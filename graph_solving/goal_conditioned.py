@@ -0,0 +1,140 @@
+import random
+import time
+
+import numpy as np
+
+from csr import segment_max
+from qlearnsolver import GOAL_REWARD
+
+
+# Q values for every goal at once: Q[g, e] is the value of taking edge e when
+# heading for goal g. Memory is num_nodes * num_edges, so this is meant for
+# graphs where one training run is amortized over many (start, goal) queries.
+class GoalConditionedQLearner:
+    def __init__(self, adjacency, gamma):
+        self.adjacency = adjacency
+        self.gamma = gamma
+        self.Q = np.zeros((adjacency.num_rows, adjacency.num_edges))
+
+    def next_state_values(self, next_state):
+        # max over the actions of next_state, for every goal
+        lo = self.adjacency.indptr[next_state]
+        hi = self.adjacency.indptr[next_state + 1]
+        if lo == hi:
+            values = np.zeros(self.adjacency.num_rows)
+        else:
+            values = np.maximum(self.Q[:, lo:hi].max(axis=1), 0)
+        # Reaching the goal ends the episode for that goal
+        values[next_state] = 0
+        return values
+
+    def execute_step(self, current_state, next_state):
+        # One transition updates the Q value of its edge for all goals
+        edge = self.adjacency.find(current_state, next_state)
+        values = self.gamma * self.next_state_values(next_state)
+        values[next_state] += GOAL_REWARD
+        self.Q[:, edge] = values
+
+
+class GoalConditionedSolver:
+    def __init__(self, adjacency, gamma=0.3):
+        self.adjacency = adjacency
+        self.num_nodes = adjacency.num_rows
+        self.qlearner = GoalConditionedQLearner(adjacency, gamma)
+        self.training_episodes = 0
+
+    @classmethod
+    def from_solver(cls, qlearnsolver, gamma=0.3):
+        if qlearnsolver.adjacency is None:
+            qlearnsolver.freeze()
+        return cls(qlearnsolver.adjacency, gamma)
+
+    def execute_training(self, start):
+        # Random walk from start until a dead end or a cycle. There is no goal
+        # to stop at since every transition teaches every goal.
+        indptr, indices = self.adjacency.indptr, self.adjacency.indices
+        current_state = start
+        visited = {start}
+        while True:
+            actions = [action for action in indices[indptr[current_state]:indptr[current_state + 1]].tolist()
+                       if action not in visited]
+            if len(actions) == 0:
+                return
+            next_state = actions[random.randint(0, len(actions) - 1)]
+            visited.add(next_state)
+            self.qlearner.execute_step(current_state, next_state)
+            current_state = next_state
+
+    def train(self, num_episodes=10000):
+        start_time = time.time()
+        for i in range(0, num_episodes):
+            self.execute_training(random.randint(0, self.num_nodes - 1))
+        self.training_episodes += num_episodes
+        return {"episodes": num_episodes, "seconds": time.time() - start_time}
+
+    def execute_value_iteration(self, tolerance=1e-6, max_sweeps=1000):
+        # Synchronous Bellman sweeps over all goals and edges together
+        adjacency = self.adjacency
+        counts = np.diff(adjacency.indptr)
+        nonempty = counts > 0
+        goals = np.arange(self.num_nodes)
+        rewards = np.where(adjacency.indices[None, :] == goals[:, None], GOAL_REWARD, 0.0)
+        Q = self.qlearner.Q
+
+        sweeps = 0
+        residual = 0.0
+        while sweeps < max_sweeps:
+            V = np.zeros((self.num_nodes, self.num_nodes))
+            if adjacency.num_edges > 0:
+                V[:, nonempty] = np.maximum(np.maximum.reduceat(Q, adjacency.indptr[:-1][nonempty], axis=1), 0)
+            V[goals, goals] = 0
+            new_Q = rewards + self.qlearner.gamma * V[:, adjacency.indices]
+            residual = float(np.abs(new_Q - Q).max()) if Q.size > 0 else 0.0
+            Q = new_Q
+            sweeps += 1
+            if residual < tolerance:
+                break
+
+        self.qlearner.Q = Q
+        return {"sweeps": sweeps, "residual": residual, "converged": residual < tolerance}
+
+    def query(self, starts, goals):
+        # Greedy paths for many (start, goal) pairs, advanced in lock-step.
+        # Every step takes the first neighbor with the largest positive Q
+        # value for the query's goal, or the first neighbor if none is
+        # positive, like QLearnSolver.execute. A path stops at its goal, at a
+        # dead end or when it would revisit a node.
+        adjacency = self.adjacency
+        starts = np.asarray(starts, dtype=np.int64)
+        goals = np.asarray(goals, dtype=np.int64)
+        paths = [[start] for start in starts.tolist()]
+        on_path = [{start} for start in starts.tolist()]
+
+        current = starts.copy()
+        active = np.flatnonzero(current != goals)
+        while len(active) > 0:
+            edge_ids, counts = adjacency.gather_rows(current[active])
+            owner = np.repeat(np.arange(len(active)), counts)
+            values = self.qlearner.Q[goals[active][owner], edge_ids]
+
+            best = segment_max(values, counts, 0)
+            candidate = (values > 0) & (values == best[owner])
+            nonempty = counts > 0
+            offsets = (np.cumsum(counts) - counts)[nonempty]
+            choice = np.full(len(active), -1, dtype=np.int64)
+            if len(edge_ids) > 0:
+                first = np.minimum.reduceat(np.where(candidate, np.arange(len(edge_ids)), len(edge_ids)), offsets)
+                choice[nonempty] = adjacency.indices[edge_ids[np.where(first == len(edge_ids), offsets, first)]]
+
+            still_active = []
+            for query, next_state in zip(active.tolist(), choice.tolist()):
+                if next_state < 0 or next_state in on_path[query]:
+                    continue
+                paths[query].append(next_state)
+                on_path[query].add(next_state)
+                current[query] = next_state
+                if next_state != goals[query]:
+                    still_active.append(query)
+            active = np.array(still_active, dtype=np.int64)
+
+        return paths
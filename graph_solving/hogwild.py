@@ -0,0 +1,112 @@
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from qlearn import SparseQLearner
+from qlearnsolver import create_new_qlearn_solver
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(qlearnsolver, shm_name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    qlearnsolver.qlearner.Q = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker["shm"] = shm
+    _worker["qlearnsolver"] = qlearnsolver
+
+
+def _run_episodes(num_episodes, seed):
+    random.seed(seed)
+    qlearnsolver = _worker["qlearnsolver"]
+    for i in range(0, num_episodes):
+        qlearnsolver.execute_training()
+    return num_episodes
+
+
+# Trains the Q table of one solver from several processes at once. The table
+# lives in shared memory and every worker runs plain execute_training
+# episodes against it without any locking: concurrent updates to the same
+# cell can overwrite each other, which Hogwild style training tolerates since
+# a lost update is simply redone by a later episode.
+class HogwildTrainer:
+    def __init__(self, qlearnsolver, num_workers):
+        self.qlearnsolver = qlearnsolver
+        self.num_workers = num_workers
+
+    def train(self, num_episodes, seed=0):
+        qlearnsolver = self.qlearnsolver
+        if qlearnsolver.adjacency is None:
+            qlearnsolver.freeze()
+        Q = qlearnsolver.qlearner.Q
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, Q.nbytes))
+        try:
+            shared_Q = np.ndarray(Q.shape, dtype=Q.dtype, buffer=shm.buf)
+            shared_Q[:] = Q
+
+            seeds = np.random.SeedSequence(seed).generate_state(self.num_workers)
+            chunks = [num_episodes // self.num_workers + (1 if i < num_episodes % self.num_workers else 0)
+                      for i in range(0, self.num_workers)]
+
+            start_time = time.time()
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker,
+                                     initargs=(qlearnsolver, shm.name, Q.shape, Q.dtype.str)) as executor:
+                futures = [executor.submit(_run_episodes, chunk, int(worker_seed))
+                           for chunk, worker_seed in zip(chunks, seeds)]
+                episodes = sum(future.result() for future in futures)
+            elapsed = time.time() - start_time
+
+            Q[:] = shared_Q
+            if qlearnsolver.qlearner.policy is not None:
+                qlearnsolver.qlearner.policy.rebuild()
+            # The view has to go before the segment can be closed
+            del shared_Q
+        finally:
+            shm.close()
+            shm.unlink()
+
+        qlearnsolver.training_episodes = episodes
+        return {
+            "episodes": episodes,
+            "workers": self.num_workers,
+            "seconds": elapsed,
+            "episodes_per_sec": episodes / elapsed if elapsed > 0 else float("inf"),
+        }
+
+
+def benchmark(num_nodes=50000, num_episodes=200000, worker_counts=(1, 2, 4, 8), seed=0):
+    random.seed(seed)
+    qlearner = SparseQLearner(num_nodes, 0.3)
+    qlearnsolver = create_new_qlearn_solver(num_nodes, qlearner, sparse=True)
+    qlearnsolver.freeze()
+
+    results = []
+    for num_workers in worker_counts:
+        qlearner.Q[:] = 0
+        stats = HogwildTrainer(qlearnsolver, num_workers).train(num_episodes, seed)
+        results.append(stats)
+
+    base = results[0]["episodes_per_sec"]
+    for stats in results:
+        print("Workers: %2d Episodes/sec: %10.0f Speedup: %.2fx" %
+              (stats["workers"], stats["episodes_per_sec"], stats["episodes_per_sec"] / base))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--episodes", type=int, default=200000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.nodes, args.episodes, args.workers, args.seed)
+
+
+if __name__ == "__main__":
+    main()
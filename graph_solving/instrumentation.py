@@ -0,0 +1,56 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Ways a training episode can end
+OUTCOMES = ("goal", "dead_end", "cycle")
+
+
+# Counters and timings collected while a QLearnSolver trains. Collection is
+# switched on by attaching an instance with QLearnSolver.enable_stats(); while
+# none is attached the hot loops only pay for an `is not None` check.
+class TrainingStats:
+    def __init__(self):
+        self.episodes = 0
+        self.steps = 0
+        # Random draws of an already visited neighbor, which cost a step of
+        # the loop without moving
+        self.retries = 0
+        self.q_updates = 0
+        self.outcomes = dict((outcome, 0) for outcome in OUTCOMES)
+        self.steps_per_episode = []
+        self.phase_seconds = {}
+
+    def end_episode(self, steps, outcome):
+        self.episodes += 1
+        self.steps += steps
+        self.outcomes[outcome] += 1
+        self.steps_per_episode.append(steps)
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.perf_counter() - start_time
+
+    def to_dict(self):
+        training_seconds = sum(seconds for name, seconds in self.phase_seconds.items() if name.startswith("train"))
+        return {
+            "episodes": self.episodes,
+            "steps": self.steps,
+            "retries": self.retries,
+            "q_updates": self.q_updates,
+            "outcomes": dict(self.outcomes),
+            "steps_per_episode": {
+                "mean": self.steps / self.episodes if self.episodes > 0 else 0.0,
+                "max": max(self.steps_per_episode) if self.steps_per_episode else 0,
+                "values": list(self.steps_per_episode),
+            },
+            "q_updates_per_second": self.q_updates / training_seconds if training_seconds > 0 else 0.0,
+            "phase_seconds": dict(self.phase_seconds),
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent)
@@ -0,0 +1,101 @@
+import heapq
+import time
+
+import numpy as np
+
+from csr import segment_max
+
+
+# Model based planning over the known graph and rewards of a QLearnSolver.
+# States are kept in a priority queue ordered by their Bellman error, the
+# state with the largest error gets all its out-edges backed up first, and the
+# change is pushed backwards to its predecessors. Compared with random walk
+# episodes no update is spent on parts of the graph which are already
+# consistent, which pays off most on long-diameter graphs.
+class PrioritizedSweepingPlanner:
+    def __init__(self, qlearnsolver, theta=1e-9):
+        self.qlearnsolver = qlearnsolver
+        self.theta = theta
+        # Q values written, states backed up and queue insertions
+        self.updates = 0
+        self.state_backups = 0
+        self.pushes = 0
+
+    def bellman_errors(self):
+        # Largest |target - Q| over the out-edges of every state
+        qlearnsolver = self.qlearnsolver
+        adjacency = qlearnsolver.adjacency
+        counts = np.diff(adjacency.indptr)
+        Q = qlearnsolver.qlearner.get_edge_Q_values(adjacency, np.arange(adjacency.num_edges))
+        V = segment_max(Q, counts, 0)
+        V[qlearnsolver.goal] = 0
+        errors = np.abs(adjacency.data + qlearnsolver.qlearner.gamma * V[adjacency.indices] - Q)
+        return segment_max(errors, counts, 0)
+
+    def plan(self, states=None, max_updates=None):
+        # Without states every state with a Bellman error above theta is
+        # queued. With states only those are queued, unconditionally, which is
+        # how edits to the graph are repaired.
+        qlearnsolver = self.qlearnsolver
+        if qlearnsolver.adjacency is None:
+            qlearnsolver.freeze()
+        adjacency = qlearnsolver.adjacency
+        predecessors = qlearnsolver.predecessors()
+        qlearner = qlearnsolver.qlearner
+        gamma = qlearner.gamma
+        start_time = time.time()
+        updates = self.updates
+        state_backups = self.state_backups
+        pushes = self.pushes
+
+        priority = {}
+        heap = []
+        if states is None:
+            errors = self.bellman_errors()
+            for state in np.flatnonzero(errors > self.theta).tolist():
+                priority[state] = errors[state]
+        else:
+            for state in states:
+                priority[state] = float("inf")
+        for state, error in priority.items():
+            heap.append((-error, state))
+            self.pushes += 1
+        heapq.heapify(heap)
+
+        while heap:
+            if max_updates is not None and self.updates - updates >= max_updates:
+                break
+            error, state = heapq.heappop(heap)
+            # Skip entries superseded by a later push with a higher priority
+            if priority.get(state) != -error:
+                continue
+            del priority[state]
+
+            actions = adjacency.neighbors(state).tolist()
+            rewards = adjacency.row_data(state).tolist()
+            for next_state, reward in zip(actions, rewards):
+                qlearner.set_Q_value(state, next_state, reward + gamma * qlearnsolver.state_value(next_state))
+            self.updates += len(actions)
+            self.state_backups += 1
+
+            if state == qlearnsolver.goal:
+                continue
+            value = qlearnsolver.state_value(state)
+            sources = predecessors.neighbors(state).tolist()
+            rewards = predecessors.row_data(state).tolist()
+            for predecessor, reward in zip(sources, rewards):
+                error = abs(reward + gamma * value - qlearner.get_Q_value(predecessor, state))
+                if error > self.theta and error > priority.get(predecessor, -1):
+                    priority[predecessor] = error
+                    heapq.heappush(heap, (-error, predecessor))
+                    self.pushes += 1
+
+        if qlearnsolver.stats is not None:
+            qlearnsolver.stats.q_updates += self.updates - updates
+        return {
+            "updates": self.updates - updates,
+            "state_backups": self.state_backups - state_backups,
+            "pushes": self.pushes - pushes,
+            "queued": len(priority),
+            "seconds": time.time() - start_time,
+        }
@@ -0,0 +1,80 @@
+import numpy as np
+
+from csr import segment_max
+
+
+# Greedy action of every state, cached so that following the policy is a chain
+# of array lookups instead of a scan over the Q values of every neighbor.
+#
+# The action of a state is the same one the scan in QLearnSolver.greedy_path
+# picks: the first neighbor with the largest positive Q value, or the first
+# neighbor when none is positive. The learner reports every Q write through
+# update() or invalidate(); writes which can only raise the best value patch
+# the entry in place, anything else marks the state dirty and it is rescanned
+# the next time it is looked up.
+class GreedyPolicy:
+    def __init__(self, adjacency, qlearner):
+        self.adjacency = adjacency
+        self.qlearner = qlearner
+        self.best = np.full(adjacency.num_rows, -1, dtype=np.int64)
+        self.best_value = np.zeros(adjacency.num_rows)
+        self.dirty = np.zeros(adjacency.num_rows, dtype=bool)
+        self.rebuild()
+
+    def rebuild(self):
+        adjacency = self.adjacency
+        num_edges = adjacency.num_edges
+        counts = np.diff(adjacency.indptr)
+        values = self.qlearner.get_edge_Q_values(adjacency, np.arange(num_edges))
+
+        best_value = segment_max(values, counts, 0)
+        rows = adjacency.row_ids()
+        candidate = (values > 0) & (values == best_value[rows])
+
+        self.best[:] = -1
+        self.best_value[:] = best_value
+        nonempty = counts > 0
+        if num_edges > 0:
+            first = np.minimum.reduceat(np.where(candidate, np.arange(num_edges), num_edges),
+                                        adjacency.indptr[:-1][nonempty])
+            first = np.where(first == num_edges, adjacency.indptr[:-1][nonempty], first)
+            self.best[nonempty] = adjacency.indices[first]
+        self.dirty[:] = False
+
+    def _rescan(self, state):
+        actions = self.adjacency.neighbors(state)
+        self.dirty[state] = False
+        if len(actions) == 0:
+            self.best[state] = -1
+            self.best_value[state] = 0
+            return
+        values = np.array([self.qlearner.get_Q_value(state, action) for action in actions.tolist()])
+        best = int(np.argmax(values))
+        if values[best] > 0:
+            self.best[state] = actions[best]
+            self.best_value[state] = values[best]
+        else:
+            self.best[state] = actions[0]
+            self.best_value[state] = 0
+
+    def update(self, state, next_state, value):
+        if self.dirty[state]:
+            return
+        if value > self.best_value[state]:
+            self.best[state] = next_state
+            self.best_value[state] = value
+        elif next_state == self.best[state]:
+            # The best value went down, some other neighbor may be ahead now
+            if value < self.best_value[state]:
+                self.dirty[state] = True
+        elif value == self.best_value[state] and value > 0:
+            # A tie, which is won by whichever neighbor comes first
+            self.dirty[state] = True
+
+    def invalidate(self, states):
+        self.dirty[states] = True
+
+    def action(self, state):
+        if self.dirty[state]:
+            self._rescan(state)
+        return self.best[state]
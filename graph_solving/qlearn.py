@@ -1,31 +1,205 @@
+import numpy as np
+
+from csr import segment_max
+
+# Traces which decayed below this are dropped
+TRACE_THRESHOLD = 1e-6
+
+
 class QLearner:
-    def __init__(self, model_size, gamma):
-        size = model_size
-        self.Q = [[0] * size for _ in range(0, size)]
+    def __init__(self, model_size, gamma, lam=0.0):
+        self.model_size = model_size
+        self.Q = self.allocate_Q(model_size)
         self.gamma = gamma
+        self.lam = lam
+        # Eligibility traces of the state-action pairs visited in the current
+        # episode, only used when lam > 0
+        self.traces = {}
         self.start = -1
         self.goal = -1
         self.current_state = -1
+        # Actions of current_state, known once a step has moved into it
+        self.current_state_actions = None
+        self.max_delta = 0
+        # Optional GreedyPolicy which is told about every Q write
+        self.policy = None
+        # Optional TrainingStats counting the Q updates
+        self.stats = None
+
+    def allocate_Q(self, model_size):
+        return np.zeros((model_size, model_size))
 
     def set_start_and_goal(self, start, goal):
         self.start = start
         self.goal = goal
         self.current_state = start
+        self.current_state_actions = None
+        self.traces = {}
 
     def update_current_state(self, state):
         self.current_state = state
 
-    def execute_step(self, next_state, next_state_actions, reward_matrix):
-        next_state_action_Q = 0
+    def max_Q_value(self, state, actions):
+        # A single fancy-indexed reduction over the row of the state. Episodes
+        # end at the goal, so nothing is earned past it.
+        if state == self.goal or len(actions) == 0:
+            return 0
+        return max(0, self.Q[state, actions].max())
 
-        for i in range(0, len(next_state_actions)):
-            next_state_action_Q = max(next_state_action_Q, self.Q[next_state][next_state_actions[i]])
+    def execute_step(self, next_state, next_state_actions, reward_matrix):
+        next_state_action_Q = self.max_Q_value(next_state, next_state_actions)
 
-        self.Q[self.current_state][next_state] = reward_matrix[self.current_state][next_state] + self.gamma * next_state_action_Q
+        value = reward_matrix[self.current_state, next_state] + self.gamma * next_state_action_Q
+        # Largest change since the caller last reset it, used for early stopping
+        self.max_delta = max(self.max_delta, abs(value - self.get_Q_value(self.current_state, next_state)))
+        if self.lam > 0:
+            self.update_traces(self.current_state, next_state, value)
+        else:
+            self.set_Q_value(self.current_state, next_state, value)
+            if self.stats is not None:
+                self.stats.q_updates += 1
         self.current_state = next_state
+        self.current_state_actions = next_state_actions
+
+    def update_traces(self, current_state, next_state, value):
+        # Watkins's Q(lambda): the TD error of this step is also applied to
+        # every pair visited earlier in the episode, weighted by its decayed
+        # trace, for as long as the episode followed the greedy policy. A
+        # pair's trace only carries the error back when the steps after it
+        # are the ones its Q value was backed up from, so an exploratory step
+        # cuts all traces first. With a learning rate of 1 the current pair
+        # gets the same value the one step backup would give it.
+        if self.current_state_actions is not None and \
+                self.get_Q_value(current_state, next_state) < self.max_Q_value(current_state, self.current_state_actions):
+            self.traces = {}
+        delta = value - self.get_Q_value(current_state, next_state)
+        self.traces[(current_state, next_state)] = 1.0
+
+        decay = self.gamma * self.lam
+        if self.stats is not None and delta != 0:
+            self.stats.q_updates += len(self.traces)
+        for (state, action), trace in list(self.traces.items()):
+            if delta != 0:
+                self.set_Q_value(state, action, self.get_Q_value(state, action) + delta * trace)
+                self.max_delta = max(self.max_delta, abs(delta * trace))
+            trace *= decay
+            if trace < TRACE_THRESHOLD:
+                del self.traces[(state, action)]
+            else:
+                self.traces[(state, action)] = trace
 
     def stop_training(self):
         self.gamma = 1.0
 
     def get_Q_value(self, current_state, next_state):
-        return self.Q[current_state][next_state]
\ No newline at end of file
+        return self.Q[current_state, next_state]
+
+    def set_Q_value(self, current_state, next_state, value):
+        self.Q[current_state, next_state] = value
+        if self.policy is not None:
+            self.policy.update(current_state, next_state, value)
+
+    # Called after the edge current_state -> next_state was added to or
+    # removed from the adjacency at position pos
+    def insert_edge(self, current_state, next_state, pos):
+        self.Q[current_state, next_state] = 0
+        if self.policy is not None:
+            self.policy.invalidate(current_state)
+
+    def remove_edge(self, current_state, next_state, pos):
+        self.Q[current_state, next_state] = 0
+        if self.policy is not None:
+            self.policy.invalidate(current_state)
+
+    # Vectorized access by edge id of the given adjacency
+    def get_edge_Q_values(self, adjacency, edge_ids):
+        return self.Q[adjacency.row_ids()[edge_ids], adjacency.indices[edge_ids]]
+
+    def set_edge_Q_values(self, adjacency, edge_ids, values):
+        self.Q[adjacency.row_ids()[edge_ids], adjacency.indices[edge_ids]] = values
+        if self.policy is not None:
+            self.policy.invalidate(adjacency.row_ids()[edge_ids])
+
+    def max_Q_values(self, adjacency, states):
+        edge_ids, counts = adjacency.gather_rows(states)
+        values = segment_max(self.get_edge_Q_values(adjacency, edge_ids), counts, 0)
+        values[np.asarray(states) == self.goal] = 0
+        return values
+
+    def execute_batch(self, adjacency, states, next_states, rewards):
+        # One-step backups for a minibatch of transitions in one vectorized
+        # call. All targets are computed before any write, so duplicates of a
+        # transition in the batch write the same value. Returns the TD errors.
+        edge_ids = adjacency.find_edges(states, next_states)
+        if (edge_ids < 0).any():
+            raise KeyError("Transitions along edges which are not in the adjacency")
+        targets = rewards + self.gamma * self.max_Q_values(adjacency, next_states)
+        errors = targets - self.get_edge_Q_values(adjacency, edge_ids)
+        self.set_edge_Q_values(adjacency, edge_ids, targets)
+        if self.stats is not None:
+            self.stats.q_updates += len(edge_ids)
+        return errors
+
+
+# Q values stored per edge of the graph instead of per (state, state) cell, so
+# memory grows with the number of edges instead of with the number of states
+# squared. Q is aligned with the indices of the adjacency CSRMatrix.
+class SparseQLearner(QLearner):
+    def __init__(self, model_size, gamma, lam=0.0):
+        super().__init__(model_size, gamma, lam)
+        self.adjacency = None
+
+    def allocate_Q(self, model_size):
+        # Sized once the adjacency is known, see set_adjacency
+        return np.zeros(0)
+
+    def set_adjacency(self, adjacency):
+        assert adjacency.num_rows == self.model_size
+        self.adjacency = adjacency
+        self.Q = np.zeros(adjacency.num_edges)
+        self.policy = None
+
+    def max_Q_value(self, state, actions):
+        # The actions of a state are exactly its out-edges, which form one
+        # contiguous run of Q.
+        if state == self.goal:
+            return 0
+        lo = self.adjacency.indptr[state]
+        hi = self.adjacency.indptr[state + 1]
+        if lo == hi:
+            return 0
+        return max(0, self.Q[lo:hi].max())
+
+    def get_Q_value(self, current_state, next_state):
+        pos = self.adjacency.find(current_state, next_state)
+        if pos < 0:
+            return 0
+        return self.Q[pos]
+
+    def set_Q_value(self, current_state, next_state, value):
+        pos = self.adjacency.find(current_state, next_state)
+        if pos < 0:
+            raise KeyError("No edge %s -> %s" % (current_state, next_state))
+        self.Q[pos] = value
+        if self.policy is not None:
+            self.policy.update(current_state, next_state, value)
+
+    def insert_edge(self, current_state, next_state, pos):
+        self.Q = np.insert(self.Q, pos, 0.0)
+        if self.policy is not None:
+            self.policy.invalidate(current_state)
+
+    def remove_edge(self, current_state, next_state, pos):
+        self.Q = np.delete(self.Q, pos)
+        if self.policy is not None:
+            self.policy.invalidate(current_state)
+
+    def get_edge_Q_values(self, adjacency, edge_ids):
+        assert adjacency is self.adjacency
+        return self.Q[edge_ids]
+
+    def set_edge_Q_values(self, adjacency, edge_ids, values):
+        assert adjacency is self.adjacency
+        self.Q[edge_ids] = values
+        if self.policy is not None:
+            self.policy.invalidate(adjacency.row_ids()[edge_ids])
@@ -1,57 +1,316 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+# networkx and matplotlib are only imported by the code paths which need them,
+# so that training on a frozen or checkpointed graph starts fast and works
+# without either of them or a display being available.
+import numpy as np
 import random
 import pickle
 import os
-import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 
-from qlearn import QLearner
+from checkpoint import read_checkpoint, write_checkpoint
+from csr import CSRMatrix, segment_max
+from instrumentation import TrainingStats
+from planner import PrioritizedSweepingPlanner
+from policy import GreedyPolicy
+from qlearn import QLearner, SparseQLearner
+
+
+TRAINING_ENGINES = ("random_walk", "swap_remove", "batch", "value_iteration", "prioritized_sweeping")
+GOAL_REWARD = 100
+
+
+# Stand-in for every class found in a legacy pickle, so that loading one only
+# restores plain attribute dictionaries
+class _LegacyObject:
+    pass
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module in ("__main__", "qlearn", "qlearnsolver") or module.startswith("networkx"):
+            return _LegacyObject
+        return super().find_class(module, name)
 
 
 class QLearnSolver:
-    def __init__(self, num_nodes, start, goal, qlearner):
+    def __init__(self, num_nodes, start, goal, qlearner, sparse=False, adjacency=None):
         self.num_nodes = num_nodes
         self.start = start
         self.goal = goal
-        self.graph = nx.DiGraph()
+        self._graph = None
         self.qlearner = qlearner
+        # The learner treats the goal as terminal, so it has to know it
+        self.qlearner.set_start_and_goal(start, goal)
+        self.sparse = sparse
+        self.adjacency = None
+        self._adjacency_lists = None
+        self._predecessors = None
+        self.training_episodes = 0
+        # Optional ReplayBuffer which execute_training records transitions into
+        self.replay_buffer = None
+        # Optional TrainingStats, see enable_stats
+        self.stats = None
 
         assert 0 <= start <= num_nodes - 1
         assert 0 <= goal <= num_nodes - 1
 
+        if adjacency is not None:
+            # Restore a solver from a frozen adjacency whose data holds the rewards
+            assert adjacency.num_rows == num_nodes
+            self.adjacency = adjacency
+            if sparse:
+                self.reward_matrix = adjacency
+                self.qlearner.set_adjacency(adjacency)
+            else:
+                self.reward_matrix = np.zeros((num_nodes, num_nodes))
+                self.reward_matrix[adjacency.row_ids(), adjacency.indices] = adjacency.data
+            return
+
+        import networkx as nx
+        self._graph = nx.DiGraph()
+
         for i in range(0, num_nodes):
             self.graph.add_node(i)
 
         for i in range(0, num_nodes):
             n1 = random.randint(0, num_nodes - 1)
             n2 = random.randint(0, num_nodes - 1)
-            if n1 == n2 or n1 in self.graph.neighbors(n2):
+            if n1 == n2 or self.graph.has_edge(n2, n1):
                 continue
             self.graph.add_edge(n1, n2)
 
         # Make sure there is atleast one edge between the start and goal
-        if start in self.graph.neighbors(goal):
+        if self.graph.has_edge(goal, start):
             self.graph.remove_edge(goal, start)
 
         self.graph.add_edge(start, goal)
 
         # Create reward matrix
-        self.reward_matrix = [[0] * (num_nodes) for _ in range(0, num_nodes)]
-
-        goal_reward = 100
-        for u, v in self.graph.edges():
-            if v == goal:
-                self.reward_matrix[u][v] = goal_reward
+        goal_reward = GOAL_REWARD
+        if sparse:
+            # Only store the rewards of the edges which exist in the graph. The
+            # Q values of the learner are laid out along the same edges.
+            edges = np.array(list(self.graph.edges()), dtype=np.int64).reshape(-1, 2)
+            rewards = np.where(edges[:, 1] == goal, goal_reward, 0)
+            self.reward_matrix = CSRMatrix.from_edges(num_nodes, edges[:, 0], edges[:, 1], rewards)
+            self.qlearner.set_adjacency(self.reward_matrix)
+        else:
+            self.reward_matrix = np.zeros((num_nodes, num_nodes))
+            for u, v in self.graph.edges():
+                if v == goal:
+                    self.reward_matrix[u][v] = goal_reward
+
+    @property
+    def graph(self):
+        # Solvers restored from a checkpoint only carry the adjacency arrays,
+        # the networkx graph is rebuilt from them when something asks for it.
+        if self._graph is None:
+            import networkx as nx
+            self._graph = nx.DiGraph()
+            self._graph.add_nodes_from(range(0, self.num_nodes))
+            self._graph.add_edges_from(self.adjacency.edges())
+        return self._graph
 
     def get_model_size(self):
         return self.num_nodes - 1
 
+    def freeze(self):
+        # Snapshot the graph into flat offset / neighbor arrays so that the
+        # training and execution loops never go through networkx.
+        with self.phase("freeze"):
+            self._freeze()
+        return self.adjacency
+
+    def _freeze(self):
+        if self.sparse:
+            self.adjacency = self.reward_matrix
+        else:
+            edges = np.array(list(self.graph.edges()), dtype=np.int64).reshape(-1, 2)
+            self.adjacency = CSRMatrix.from_edges(self.num_nodes, edges[:, 0], edges[:, 1],
+                                                  self.reward_matrix[edges[:, 0], edges[:, 1]])
+        self._adjacency_lists = None
+        self._predecessors = None
+
+    def adjacency_lists(self):
+        if self._adjacency_lists is None:
+            self._adjacency_lists = (self.adjacency.indptr.tolist(), self.adjacency.indices.tolist())
+        return self._adjacency_lists
+
+    def predecessors(self):
+        # Reverse adjacency: the neighbors of a node are the nodes with an
+        # edge into it
+        if self.adjacency is None:
+            self.freeze()
+        if self._predecessors is None:
+            self._predecessors = self.adjacency.transpose()
+        return self._predecessors
+
+    def add_edge(self, u, v, repair=True):
+        # Inserts the edge into the adjacency, rewards and Q, then repairs the
+        # Q values around it so that no retraining from scratch is needed
+        predecessors = self.predecessors()
+        reward = GOAL_REWARD if v == self.goal else 0
+        pos = self.adjacency.insert(u, v, reward)
+        predecessors.insert(v, u, reward)
+        if not self.sparse:
+            self.reward_matrix[u, v] = reward
+        self.qlearner.insert_edge(u, v, pos)
+        self._edges_changed()
+        if self._graph is not None:
+            self._graph.add_edge(u, v)
+        if repair:
+            return self.repair([u])
+
+    def remove_edge(self, u, v, repair=True):
+        predecessors = self.predecessors()
+        pos = self.adjacency.remove(u, v)
+        predecessors.remove(v, u)
+        if not self.sparse:
+            self.reward_matrix[u, v] = 0
+        self.qlearner.remove_edge(u, v, pos)
+        self._edges_changed()
+        if self._graph is not None:
+            self._graph.remove_edge(u, v)
+        if repair:
+            return self.repair([u])
+
+    def _edges_changed(self):
+        self._adjacency_lists = None
+        # The sparse learner and sparse rewards share the adjacency object,
+        # which insert and remove update in place
+        if self.sparse:
+            self.reward_matrix = self.adjacency
+
+    def state_value(self, state):
+        if state == self.goal:
+            return 0
+        return self.qlearner.max_Q_value(state, self.adjacency.neighbors(state))
+
+    def repair(self, states, tolerance=0.0):
+        # Backs up the given states and sweeps the change backwards through
+        # their predecessors for as long as it moves any Q value by more than
+        # tolerance, so the work follows the region the change affects.
+        planner = PrioritizedSweepingPlanner(self, tolerance)
+        stats = planner.plan(states)
+        return {"updates": stats["updates"], "states": stats["state_backups"]}
+
+    def save_checkpoint(self, path):
+        # Edge list, rewards and the Q value of every edge as typed arrays. The
+        # Q table of a dense learner is only ever written along edges, so
+        # storing it per edge loses nothing.
+        if self.adjacency is None:
+            self.freeze()
+        adjacency = self.adjacency
+        header = {
+            "num_nodes": self.num_nodes,
+            "start": self.start,
+            "goal": self.goal,
+            "gamma": self.qlearner.gamma,
+            "lam": self.qlearner.lam,
+            "sparse": self.sparse,
+            "training_episodes": self.training_episodes,
+        }
+        arrays = {
+            "indptr": adjacency.indptr,
+            "indices": adjacency.indices,
+            "rewards": adjacency.data,
+            "Q": self.qlearner.get_edge_Q_values(adjacency, np.arange(adjacency.num_edges)),
+        }
+        write_checkpoint(path, header, arrays)
+
+    @classmethod
+    def load_checkpoint(cls, path, mmap=True):
+        header, arrays = read_checkpoint(path, mmap)
+        num_nodes = header["num_nodes"]
+        adjacency = CSRMatrix(num_nodes, arrays["indptr"], arrays["indices"], arrays["rewards"])
+
+        # Checkpoints written before traces existed have no lam
+        lam = header.get("lam", 0.0)
+        if header["sparse"]:
+            qlearner = SparseQLearner(num_nodes, header["gamma"], lam)
+        else:
+            qlearner = QLearner(num_nodes, header["gamma"], lam)
+        qlearnsolver = cls(num_nodes, header["start"], header["goal"], qlearner, header["sparse"], adjacency)
+        qlearnsolver.training_episodes = header["training_episodes"]
+
+        if header["sparse"]:
+            # Zero copy, the Q values stay a view of the file
+            qlearner.Q = arrays["Q"]
+        else:
+            qlearner.set_edge_Q_values(adjacency, np.arange(adjacency.num_edges), arrays["Q"])
+        return qlearnsolver
+
+    @classmethod
+    def load_legacy_pickle(cls, path):
+        # Whole-object pickles written by older versions hold a networkx graph,
+        # a list of lists reward matrix and a dense QLearner with a list of
+        # lists Q. Their attributes are read without running any of the old
+        # classes and converted into a solver over a CSR adjacency.
+        with open(path, 'rb') as input:
+            legacy = _LegacyUnpickler(input).load()
+        state = legacy.__dict__
+        num_nodes = state["num_nodes"]
+        graph = state["graph"].__dict__
+        successors = graph.get("succ", graph.get("_succ"))
+        reward_matrix = state["reward_matrix"]
+        legacy_qlearner = state["qlearner"].__dict__
+
+        rows = []
+        cols = []
+        for u, neighbors in successors.items():
+            for v in neighbors:
+                rows.append(u)
+                cols.append(v)
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        rewards = np.array([reward_matrix[u][v] for u, v in zip(rows.tolist(), cols.tolist())], dtype=float)
+        adjacency = CSRMatrix.from_edges(num_nodes, rows, cols, rewards)
+
+        qlearner = QLearner(num_nodes, legacy_qlearner["gamma"])
+        qlearnsolver = cls(num_nodes, state["start"], state["goal"], qlearner, False, adjacency)
+        Q = np.array(legacy_qlearner["Q"], dtype=float)
+        qlearner.set_edge_Q_values(adjacency, np.arange(adjacency.num_edges), Q[adjacency.row_ids(), adjacency.indices])
+        return qlearnsolver
+
+    def enable_stats(self):
+        self.stats = TrainingStats()
+        self.qlearner.stats = self.stats
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+        self.qlearner.stats = None
+
+    def phase(self, name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.phase(name)
+
     def execute_training(self):
+        if self.adjacency is None:
+            self.freeze()
+        # Plain lists index faster than ndarrays from interpreted code
+        indptr, indices = self.adjacency_lists()
+        stats = self.stats
+
         self.qlearner.set_start_and_goal(self.start, self.goal)
+        self.qlearner.max_delta = 0
         visited = {self.start}
+        steps = 0
         while self.qlearner.current_state != self.qlearner.goal:
             # From the current state figure out what are the possible next actions and select a random one
-            actions = self.graph.neighbors(self.qlearner.current_state)
+            lo = indptr[self.qlearner.current_state]
+            hi = indptr[self.qlearner.current_state + 1]
+            actions = indices[lo:hi]
+
+            if hi == lo:
+                if stats is not None:
+                    stats.end_episode(steps, "dead_end")
+                return
 
             # Check if all the actions have been visited or not.. If so then we have a cycle in
             # the graph
@@ -59,35 +318,328 @@ class QLearnSolver:
             for action in actions:
                 if action not in visited:
                     all_actions_visited = False
+                    break
 
             if all_actions_visited:
+                if stats is not None:
+                    stats.end_episode(steps, "cycle")
                 return
 
-            if len(actions) == 0:
-                return
-
-            max_idx = len(actions)
-            next_state = actions[random.randint(0, max_idx - 1)]
+            next_state = actions[random.randint(0, hi - lo - 1)]
             if next_state in visited:
+                if stats is not None:
+                    stats.retries += 1
                 continue
             else:
                 visited.add(next_state)
 
-            next_state_actions = self.graph.neighbors(next_state)
+            next_state_actions = indices[indptr[next_state]:indptr[next_state + 1]]
+            if self.replay_buffer is not None:
+                current_state = self.qlearner.current_state
+                self.replay_buffer.add(current_state, next_state, self.reward_matrix[current_state, next_state])
             self.qlearner.execute_step(next_state, next_state_actions, self.reward_matrix)
+            steps += 1
+
+        if stats is not None:
+            stats.end_episode(steps, "goal")
+
+    def execute_training_swap_remove(self):
+        # Same episode distribution as execute_training without its wasted
+        # iterations. The neighbors of the node being expanded are copied
+        # once, a single C level list slice, and every draw is O(1): a draw
+        # which hits a visited neighbor swaps it out of the live part of the
+        # copy, so a neighbor is drawn at most once per expansion instead of
+        # over and over. A cycle is an empty live part, an O(1) check instead
+        # of execute_training's rescan of every action on every iteration.
+        if self.adjacency is None:
+            self.freeze()
+        indptr, indices = self.adjacency_lists()
+        stats = self.stats
+        qlearner = self.qlearner
+
+        qlearner.set_start_and_goal(self.start, self.goal)
+        qlearner.max_delta = 0
+        visited = {self.start}
+        steps = 0
+        current_state = self.start
+        while current_state != self.goal:
+            lo = indptr[current_state]
+            count = indptr[current_state + 1] - lo
+            if count == 0:
+                if stats is not None:
+                    stats.end_episode(steps, "dead_end")
+                return
+
+            candidates = indices[lo:lo + count]
+            while True:
+                i = random.randint(0, count - 1)
+                next_state = candidates[i]
+                if next_state not in visited:
+                    break
+                # Lazily removed: each visited neighbor costs one draw
+                if stats is not None:
+                    stats.retries += 1
+                count -= 1
+                if count == 0:
+                    if stats is not None:
+                        stats.end_episode(steps, "cycle")
+                    return
+                candidates[i] = candidates[count]
+
+            visited.add(next_state)
+            next_state_actions = indices[indptr[next_state]:indptr[next_state + 1]]
+            if self.replay_buffer is not None:
+                self.replay_buffer.add(current_state, next_state, self.reward_matrix[current_state, next_state])
+            qlearner.execute_step(next_state, next_state_actions, self.reward_matrix)
+            current_state = next_state
+            steps += 1
+
+        if stats is not None:
+            stats.end_episode(steps, "goal")
+
+    def replay(self, batch_size=256, num_batches=1, prioritized=False, alpha=0.6):
+        # Reapplies transitions recorded in replay_buffer, a minibatch at a time
+        if self.adjacency is None:
+            self.freeze()
+        updates = 0
+        for i in range(0, num_batches):
+            if prioritized:
+                slots, states, next_states, rewards = self.replay_buffer.sample_prioritized(batch_size, alpha)
+            else:
+                slots, states, next_states, rewards = self.replay_buffer.sample(batch_size)
+            errors = self.qlearner.execute_batch(self.adjacency, states, next_states, rewards)
+            self.replay_buffer.update_priorities(slots, errors)
+            updates += len(slots)
+        return {"updates": updates}
+
+    def execute_batch_training(self, num_episodes, num_walkers=1024, seed=None):
+        # Runs num_episodes random walks from start, advancing up to
+        # num_walkers of them in lock-step. Every walker picks uniformly among
+        # its unvisited neighbors, which is the distribution the retry loop in
+        # execute_training ends up sampling from.
+        if self.adjacency is None:
+            self.freeze()
+        adjacency = self.adjacency
+        indices = adjacency.indices
+        rng = np.random.default_rng(seed)
+
+        # Bound the per-walker visited flags to ~64MB
+        num_walkers = max(1, min(num_walkers, num_episodes, (1 << 26) // self.num_nodes))
+
+        episodes = 0
+        steps = 0
+        start_time = time.time()
+        while episodes < num_episodes:
+            num_batch = min(num_walkers, num_episodes - episodes)
+            current = np.full(num_batch, self.start, dtype=np.int64)
+            visited = np.zeros((num_batch, self.num_nodes), dtype=bool)
+            visited[:, self.start] = True
+            active = np.arange(num_batch)
+            episode_steps = np.zeros(num_batch, dtype=np.int64)
+
+            while len(active) > 0:
+                edge_ids, counts = adjacency.gather_rows(current[active])
+                owner = np.repeat(np.arange(len(active)), counts)
+                free = ~visited[active[owner], indices[edge_ids]]
+
+                # Walkers at a dead end or with every neighbor visited are done
+                num_free = np.bincount(owner, weights=free, minlength=len(active)).astype(np.int64)
+                pick = (rng.random(len(active)) * num_free).astype(np.int64)
+
+                # Select the pick-th free edge of every walker
+                free_before = np.cumsum(free) - free
+                first = (np.cumsum(counts) - counts)[counts > 0]
+                base = np.zeros(len(active), dtype=np.int64)
+                base[counts > 0] = free_before[first]
+                chosen = free & (free_before - base[owner] == pick[owner])
+                walkers = active[owner[chosen]]
+                if self.stats is not None:
+                    stopped = num_free == 0
+                    for walker, count in zip(active[stopped].tolist(), counts[stopped].tolist()):
+                        self.stats.end_episode(int(episode_steps[walker]), "dead_end" if count == 0 else "cycle")
+                edges = edge_ids[chosen]
+                states = current[walkers]
+                next_states = indices[edges]
+
+                # All targets are computed from the Q values before this step,
+                # so walkers sharing an edge write the same value and the
+                # outcome does not depend on the order of the writes.
+                targets = adjacency.data[edges] + self.qlearner.gamma * self.qlearner.max_Q_values(adjacency, next_states)
+                self.qlearner.set_edge_Q_values(adjacency, edges, targets)
+                steps += len(edges)
+                if self.stats is not None:
+                    self.stats.q_updates += len(edges)
+
+                current[walkers] = next_states
+                visited[walkers, next_states] = True
+                episode_steps[walkers] += 1
+                if self.stats is not None:
+                    for walker in walkers[next_states == self.goal].tolist():
+                        self.stats.end_episode(int(episode_steps[walker]), "goal")
+                active = walkers[next_states != self.goal]
+
+            episodes += num_batch
+
+        elapsed = time.time() - start_time
+        return {
+            "episodes": episodes,
+            "steps": steps,
+            "seconds": elapsed,
+            "episodes_per_sec": episodes / elapsed if elapsed > 0 else float("inf"),
+        }
+
+    def execute_value_iteration(self, tolerance=1e-6, max_sweeps=1000):
+        # The graph and rewards are fully known, so instead of sampling
+        # episodes apply synchronous Bellman backups to every edge until the
+        # largest change in a sweep drops below the tolerance.
+        if self.adjacency is None:
+            self.freeze()
+        adjacency = self.adjacency
+        edge_ids = np.arange(adjacency.num_edges)
+        counts = np.diff(adjacency.indptr)
+        gamma = self.qlearner.gamma
+
+        Q = self.qlearner.get_edge_Q_values(adjacency, edge_ids)
+        sweeps = 0
+        residual = 0.0
+        while sweeps < max_sweeps:
+            V = segment_max(Q, counts, 0)
+            # Episodes end at the goal, so nothing is earned past it
+            V[self.goal] = 0
+            new_Q = adjacency.data + gamma * V[adjacency.indices]
+            residual = float(np.abs(new_Q - Q).max()) if len(Q) > 0 else 0.0
+            Q = new_Q
+            sweeps += 1
+            if residual < tolerance:
+                break
+
+        self.qlearner.set_edge_Q_values(adjacency, edge_ids, Q)
+        if self.stats is not None:
+            self.stats.q_updates += sweeps * adjacency.num_edges
+        return {"sweeps": sweeps, "residual": residual, "converged": residual < tolerance}
+
+    def execute_training_until_converged(self, max_episodes=10000, window=500, tolerance=1e-9,
+                                         stable_checks=None, check_every=100):
+        # Runs execute_training episodes until either no Q value moved by more
+        # than tolerance for window consecutive episodes, or the greedy path
+        # stayed the same for stable_checks checks done every check_every
+        # episodes. Either criterion can be disabled by passing None.
+        start_time = time.time()
+        quiet_episodes = 0
+        stable = 0
+        last_path = None
+        converged = False
+
+        episodes = 0
+        while episodes < max_episodes and not converged:
+            self.execute_training()
+            episodes += 1
+
+            if window is not None:
+                if self.qlearner.max_delta > tolerance:
+                    quiet_episodes = 0
+                else:
+                    quiet_episodes += 1
+                converged = quiet_episodes >= window
+
+            if stable_checks is not None and episodes % check_every == 0:
+                path = self.greedy_path()
+                if path == last_path:
+                    stable += 1
+                else:
+                    stable = 0
+                last_path = path
+                converged = converged or stable >= stable_checks
+
+        self.training_episodes = episodes
+        return {"episodes": episodes, "converged": converged, "seconds": time.time() - start_time}
+
+    def train(self, engine="random_walk", num_episodes=10000, **options):
+        with self.phase("train_" + engine):
+            if engine == "random_walk":
+                if options:
+                    return self.execute_training_until_converged(num_episodes, **options)
+                start_time = time.time()
+                for i in range(0, num_episodes):
+                    self.execute_training()
+                self.training_episodes = num_episodes
+                return {"episodes": num_episodes, "seconds": time.time() - start_time}
+            elif engine == "swap_remove":
+                start_time = time.time()
+                for i in range(0, num_episodes):
+                    self.execute_training_swap_remove()
+                self.training_episodes = num_episodes
+                return {"episodes": num_episodes, "seconds": time.time() - start_time}
+            elif engine == "batch":
+                return self.execute_batch_training(num_episodes, **options)
+            elif engine == "value_iteration":
+                return self.execute_value_iteration(**options)
+            elif engine == "prioritized_sweeping":
+                return PrioritizedSweepingPlanner(self, options.pop("theta", 1e-9)).plan(**options)
+
+        raise ValueError("Unknown training engine %s, expected one of %s" % (engine, ", ".join(TRAINING_ENGINES)))
 
     def execute(self, trace=False):
+        # Queries leave gamma alone, so repairs after later edits to the graph
+        # keep backing up with the discount the Q values were trained with
+        self.qlearner.set_start_and_goal(self.start, self.goal)
+        with self.phase("execute"):
+            if trace:
+                path = self.greedy_path(trace)
+            else:
+                if self.qlearner.policy is None:
+                    self.build_policy()
+                path = self.policy_path()
+        self.qlearner.current_state = path[-1]
+        return path
+
+    def build_policy(self):
+        # Once built the learner keeps the policy up to date with every Q
+        # write, so it can serve any number of queries.
+        if self.adjacency is None:
+            self.freeze()
+        self.qlearner.policy = GreedyPolicy(self.adjacency, self.qlearner)
+        return self.qlearner.policy
+
+    def policy_path(self):
+        policy = self.qlearner.policy
+        current_state = self.start
+        path = [current_state]
+        on_path = {current_state}
+
+        while current_state != self.goal and len(path) <= self.num_nodes:
+            next_state = int(policy.action(current_state))
+            if next_state < 0:
+                return path
+            if next_state in on_path:
+                # The scan never steps back onto a node it has already looked
+                # at, so let it resolve the cycle
+                return self.greedy_path()
+
+            path.append(next_state)
+            on_path.add(next_state)
+            current_state = next_state
+
+        return path
+
+    def greedy_path(self, trace=False):
+        # Follows the highest Q value out of every state without changing the
+        # learner, so it can also be used to monitor training.
         if trace:
             print("-" * 10 + " Execution tracing " + "-" * 10)
             print("Next State: %s" % self.start)
-        self.qlearner.set_start_and_goal(self.start, self.goal)
-        self.qlearner.stop_training()
-        path = [self.qlearner.current_state]
+        if self.adjacency is None:
+            self.freeze()
 
-        visited = {self.qlearner.current_state}
+        current_state = self.start
+        path = [current_state]
 
-        while self.qlearner.current_state != self.qlearner.goal:
-            actions = self.graph.neighbors(self.qlearner.current_state)
+        visited = {current_state}
+
+        # A path can not be longer than the number of nodes without repeating
+        # one, so give up instead of cycling forever on an untrained Q.
+        while current_state != self.goal and len(path) <= self.num_nodes:
+            actions = self.adjacency.neighbors(current_state).tolist()
 
             if len(actions) == 0:
                 return path
@@ -98,7 +650,7 @@ class QLearnSolver:
                 if action in visited:
                     continue
                 visited.add(action)
-                curr_v = self.qlearner.get_Q_value(self.qlearner.current_state, action)
+                curr_v = self.qlearner.get_Q_value(current_state, action)
                 if curr_v > max_v:
                     next_state = action
                     max_v = curr_v
@@ -107,7 +659,7 @@ class QLearnSolver:
                 print("Next State: %s Q Val: %s" % (next_state, max_v))
 
             path.append(next_state)
-            self.qlearner.current_state = next_state
+            current_state = next_state
 
         if trace:
             print("-" * 10 + " Done Execution " + "-" * 10)
@@ -115,6 +667,9 @@ class QLearnSolver:
         return path
 
     def render(self):
+        import networkx as nx
+        import matplotlib.pyplot as plt
+
         nodes = [i for i in range(0, self.num_nodes)]
         nodes.remove(self.start)
         nodes.remove(self.goal)
@@ -148,48 +703,191 @@ class QLearnSolver:
         plt.show()
         print("Rendering")
 
-def create_new_qlearn_solver(model_size, qlearner):
+def random_adjacency(num_nodes, start, goal, rng):
+    # Same graph distribution as the edge by edge construction in
+    # QLearnSolver.__init__, drawn in one batch: num_nodes candidate edges,
+    # minus self loops, where the first candidate between a pair of nodes
+    # decides the direction and later ones between the same pair are dropped.
+    n1 = rng.integers(0, num_nodes, num_nodes)
+    n2 = rng.integers(0, num_nodes, num_nodes)
+    keep = n1 != n2
+    n1 = n1[keep]
+    n2 = n2[keep]
+
+    pair = np.minimum(n1, n2) * num_nodes + np.maximum(n1, n2)
+    pair, first = np.unique(pair, return_index=True)
+
+    # Make sure there is atleast one edge between the start and goal
+    first = first[pair != min(start, goal) * num_nodes + max(start, goal)]
+    rows = np.append(n1[first], start)
+    cols = np.append(n2[first], goal)
+
+    rewards = np.where(cols == goal, GOAL_REWARD, 0)
+    return CSRMatrix.from_edges(num_nodes, rows, cols, rewards)
+
+
+def create_new_qlearn_solver(model_size, qlearner, sparse=False, vectorized=True):
     start = random.randint(0, model_size - 1)
     goal = start
     while goal == start:
         goal = random.randint(0, model_size - 1)
 
-    qlearnsolver = QLearnSolver(model_size, start, goal, qlearner)
-    qlearner.set_start_and_goal(start, goal)
+    if vectorized:
+        # Seeded from random so that random.seed() still decides the graph
+        rng = np.random.default_rng(random.getrandbits(64))
+        adjacency = random_adjacency(model_size, start, goal, rng)
+        qlearnsolver = QLearnSolver(model_size, start, goal, qlearner, sparse, adjacency)
+    else:
+        qlearnsolver = QLearnSolver(model_size, start, goal, qlearner, sparse)
     return qlearnsolver
 
 
-def main():
-    existing_file = ""
+def check_repair(seed=0, num_nodes=30, num_edits=30, sparse=False):
+    # Answers a query, then adds and removes random edges with repair after
+    # every edit, and compares the result with value iteration on the edited
+    # graph from scratch. Returns the largest Q difference.
+    random.seed(seed)
+    qlearner = SparseQLearner(num_nodes, 0.3) if sparse else QLearner(num_nodes, 0.3)
+    qlearnsolver = create_new_qlearn_solver(num_nodes, qlearner, sparse)
+    qlearnsolver.train("value_iteration")
+    qlearnsolver.execute()
+
+    for i in range(0, num_edits):
+        u = random.randint(0, num_nodes - 1)
+        v = random.randint(0, num_nodes - 1)
+        if u == v:
+            continue
+        if qlearnsolver.adjacency.find(u, v) >= 0:
+            if (u, v) != (qlearnsolver.start, qlearnsolver.goal):
+                qlearnsolver.remove_edge(u, v)
+        elif qlearnsolver.adjacency.find(v, u) < 0:
+            qlearnsolver.add_edge(u, v)
+    qlearnsolver.execute()
+
+    adjacency = qlearnsolver.adjacency
+    edge_ids = np.arange(adjacency.num_edges)
+    repaired = qlearner.get_edge_Q_values(adjacency, edge_ids).copy()
+    qlearner.set_edge_Q_values(adjacency, edge_ids, np.zeros(adjacency.num_edges))
+    qlearnsolver.train("value_iteration", tolerance=0.0)
+    return float(np.abs(repaired - qlearner.get_edge_Q_values(adjacency, edge_ids)).max())
+
+
+def run_execution_iteration(seed, model_size=10, num_training_iterations=10000,
+                            training_engine="random_walk", stopping_criterion=None):
+    # One self contained solve, seeded so that it does not depend on which
+    # process runs it or in what order
+    random.seed(seed)
+    qlearner = QLearner(model_size, 0.3)
+    qlearnsolver = create_new_qlearn_solver(model_size, qlearner)
+    stats = qlearnsolver.train(training_engine, num_training_iterations, **(stopping_criterion or {}))
+    path = qlearnsolver.execute()
+
+    passed = path[0] == qlearnsolver.start and path[-1] == qlearnsolver.goal and len(path) <= 2
+    result = {
+        "seed": seed,
+        "start": qlearnsolver.start,
+        "goal": qlearnsolver.goal,
+        "path": path,
+        # Each engine reports its own measure of work: episodes for the
+        # sampling engines, sweeps for value iteration and Q updates for the
+        # planner. The ones an engine does not do count as 0.
+        "episodes": stats.get("episodes", 0),
+        "sweeps": stats.get("sweeps", 0),
+        "updates": stats.get("updates", 0),
+        "passed": passed,
+    }
+    if not passed:
+        result["Q"] = qlearner.Q.tolist()
+    return result
+
+
+def run_parallel(num_iterations, workers=None, seed=0, **options):
+    # Spreads independent solves over a process pool. Every iteration gets its
+    # own seed derived from the base seed, so a run is reproducible for any
+    # number of workers.
+    seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(num_iterations)]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, num_iterations // (4 * workers))
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(partial(run_execution_iteration, **options), seeds, chunksize=chunksize))
+
+    failures = [result for result in results if not result["passed"]]
+    return {
+        "iterations": num_iterations,
+        "passed": num_iterations - len(failures),
+        "failed": len(failures),
+        "failures": failures,
+        "episodes": sum(result["episodes"] for result in results),
+        "sweeps": sum(result["sweeps"] for result in results),
+        "updates": sum(result["updates"] for result in results),
+        "seconds": time.time() - start_time,
+    }
 
-    if len(sys.argv) > 1:
-        existing_file = sys.argv[1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("existing_file", nargs="?", default="")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run the solves on a process pool of this many workers (0 runs them serially)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check-repair", action="store_true",
+                        help="check that edits made after a query are repaired to the value iteration result")
+    args = parser.parse_args()
+    existing_file = args.existing_file
+
+    if args.check_repair:
+        for seed in range(args.seed, args.seed + args.iterations):
+            for sparse in (False, True):
+                error = check_repair(seed, sparse=sparse)
+                if error > 1e-9:
+                    print("Repair mismatch.... Seed: %s Sparse: %s Max Q error: %s" % (seed, sparse, error))
+        print("Checked repairs for %s seeds" % args.iterations)
+        return
+
+    if existing_file == "" and args.workers > 0:
+        summary = run_parallel(args.iterations, args.workers, args.seed,
+                               stopping_criterion={"window": 500})
+        for failure in summary["failures"]:
+            print("Error in predicting.... Seed: %s Start: %s End: %s Found path: %s" %
+                  (failure["seed"], failure["start"], failure["goal"], failure["path"]))
+            print("Q = ")
+            for row in failure["Q"]:
+                print(" ".join(str(j) for j in row))
+        print("Passed: %s Failed: %s Episodes: %s Time: %.2fs" %
+              (summary["passed"], summary["failed"], summary["episodes"], summary["seconds"]))
+        return
 
     num_execution_iterations = 1
     if existing_file == "":
-        num_execution_iterations = 2000
-
+        num_execution_iterations = args.iterations
     for exec_iter in range(0, num_execution_iterations):
         print("Execution Iteration: %s" % exec_iter)
         print("-" * 50)
         num_training_iterations = 10000
+        training_engine = "random_walk"
+        # Stop once Q has not changed for this many consecutive episodes
+        stopping_criterion = {"window": 500}
         model_size = 10
         qlearner = QLearner(model_size, 0.3)
 
         if existing_file == "":
             qlearnsolver = create_new_qlearn_solver(model_size, qlearner)
-            with open('qlearnsolver.pkl', 'wb') as output:
-                pickle.dump(qlearnsolver, output, pickle.HIGHEST_PROTOCOL)
+            qlearnsolver.save_checkpoint('qlearnsolver.ckpt')
+        elif existing_file.endswith('.pkl'):
+            # Whole-object pickles written by older versions
+            qlearnsolver = QLearnSolver.load_legacy_pickle(existing_file)
+            qlearner = qlearnsolver.qlearner
+            qlearnsolver.render()
         else:
-            with open(existing_file, 'rb') as input:
-                qlearnsolver = pickle.load(input)
-                qlearnsolver.render()
+            qlearnsolver = QLearnSolver.load_checkpoint(existing_file)
+            qlearner = qlearnsolver.qlearner
+            qlearnsolver.render()
 
-        for i in range(0, num_training_iterations):
-            qlearner.set_start_and_goal(qlearnsolver.start, qlearnsolver.goal)
-            qlearnsolver.execute_training()
+        stats = qlearnsolver.train(training_engine, num_training_iterations, **stopping_criterion)
 
-        print("Completed Training")
+        print("Completed Training in %s episodes" % stats.get("episodes"))
         path = qlearnsolver.execute()
         print("Start: %s End: %s" % (qlearnsolver.start, qlearnsolver.goal))
         print("Found path: %s" % path)
@@ -202,7 +900,7 @@ def main():
             path = qlearnsolver.execute(trace=True)
 
         if existing_file == "":
-            os.remove("qlearnsolver.pkl")
+            os.remove("qlearnsolver.ckpt")
 
         print("-" * 50)
 
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+# Fixed size ring buffer of (state, next_state, reward) transitions kept in
+# preallocated arrays. States are plain ints, so the same buffer serves the
+# graph solvers and any other discretized state space. Once full the oldest
+# transitions are overwritten.
+class ReplayBuffer:
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity)
+        self.priorities = np.zeros(capacity)
+        self.max_priority = 1.0
+        self.size = 0
+        self.position = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, next_state, reward):
+        # New transitions get the highest priority seen so far, so that they
+        # are replayed at least once under prioritized sampling
+        self.states[self.position] = state
+        self.next_states[self.position] = next_state
+        self.rewards[self.position] = reward
+        self.priorities[self.position] = self.max_priority
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, states, next_states, rewards):
+        count = len(states)
+        if count > self.capacity:
+            # Only the newest capacity transitions would survive anyway
+            states = states[-self.capacity:]
+            next_states = next_states[-self.capacity:]
+            rewards = rewards[-self.capacity:]
+            self.position = (self.position + count - self.capacity) % self.capacity
+            count = self.capacity
+        slots = (self.position + np.arange(count)) % self.capacity
+        self.states[slots] = states
+        self.next_states[slots] = next_states
+        self.rewards[slots] = rewards
+        self.priorities[slots] = self.max_priority
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def _batch(self, slots):
+        return slots, self.states[slots], self.next_states[slots], self.rewards[slots]
+
+    def sample(self, batch_size):
+        # Uniform sampling with replacement. Returns the slots along with the
+        # transitions so that their priorities can be updated afterwards.
+        if self.size == 0:
+            raise ValueError("Can not sample from an empty replay buffer")
+        return self._batch(self.rng.integers(0, self.size, batch_size))
+
+    def sample_prioritized(self, batch_size, alpha=0.6):
+        # Samples proportionally to priority ** alpha
+        if self.size == 0:
+            raise ValueError("Can not sample from an empty replay buffer")
+        weights = self.priorities[:self.size] ** alpha
+        cumulative = np.cumsum(weights)
+        slots = np.searchsorted(cumulative, self.rng.random(batch_size) * cumulative[-1], side="right")
+        return self._batch(np.minimum(slots, self.size - 1))
+
+    def update_priorities(self, slots, priorities, epsilon=1e-6):
+        # Transitions whose TD error went to zero keep a small chance of
+        # being replayed
+        self.priorities[slots] = np.abs(priorities) + epsilon
+        if len(slots) > 0:
+            self.max_priority = max(self.max_priority, self.priorities[slots].max())
@@ -0,0 +1,165 @@
+import argparse
+import random
+
+import numpy as np
+
+from csr import CSRMatrix
+from qlearn import QLearner
+from qlearnsolver import GOAL_REWARD, QLearnSolver
+
+
+def chain_solver(diameter, lam, gamma=0.9, seed=0):
+    # Chain 0 -> 1 -> ... -> diameter with the goal at the end. Every other
+    # node on average also gets a forward skip over one to three nodes, so
+    # episodes take different routes and a route only gets its Q values
+    # right once it has been walked. Every node also has a backward edge to
+    # an earlier node that no skip jumps over. Every walk has visited that
+    # node, so the backward edges only add cycles: the walk never takes one
+    # and every episode reaches the goal.
+    rng = np.random.default_rng(seed)
+    num_nodes = diameter + 1
+    rows = list(range(0, diameter))
+    cols = list(range(1, num_nodes))
+    skippable = np.zeros(num_nodes, dtype=bool)
+    for node in range(0, diameter - 1):
+        if rng.random() < 0.5:
+            target = int(rng.integers(node + 2, min(node + 4, diameter) + 1))
+            rows.append(node)
+            cols.append(target)
+            skippable[node + 1:target] = True
+    for node in range(2, num_nodes):
+        targets = np.flatnonzero(~skippable[:node - 1])
+        rows.append(node)
+        cols.append(int(targets[rng.integers(0, len(targets))]))
+    rows = np.array(rows)
+    cols = np.array(cols)
+    adjacency = CSRMatrix.from_edges(num_nodes, rows, cols, np.where(cols == diameter, GOAL_REWARD, 0))
+    return QLearnSolver(num_nodes, 0, diameter, QLearner(num_nodes, gamma, lam), adjacency=adjacency)
+
+
+def episodes_to_convergence(qlearnsolver, reference, tolerance, max_episodes):
+    # Episodes until every Q value of a forward edge, chain or skip, is
+    # within tolerance of the value iteration result
+    adjacency = qlearnsolver.adjacency
+    edge_ids = np.arange(adjacency.num_edges)
+    forward = adjacency.indices > adjacency.row_ids()
+    for episode in range(1, max_episodes + 1):
+        qlearnsolver.execute_training()
+        error = np.abs(qlearnsolver.qlearner.get_edge_Q_values(adjacency, edge_ids) - reference)[forward].max()
+        if error <= tolerance:
+            return episode
+    return None
+
+
+def random_solver(num_nodes, lam, density=0.25, gamma=0.9, seed=0):
+    # Random directed graph, cycles included, with every edge present with
+    # the given density, from node 0 to the goal at num_nodes - 1
+    rng = np.random.default_rng(seed)
+    present = rng.random((num_nodes, num_nodes)) < density
+    np.fill_diagonal(present, False)
+    rows, cols = np.nonzero(present)
+    goal = num_nodes - 1
+    if not present[0, goal]:
+        rows = np.append(rows, 0)
+        cols = np.append(cols, goal)
+    adjacency = CSRMatrix.from_edges(num_nodes, rows, cols, np.where(cols == goal, GOAL_REWARD, 0))
+    return QLearnSolver(num_nodes, 0, goal, QLearner(num_nodes, gamma, lam), adjacency=adjacency)
+
+
+def takeable_edges(qlearnsolver):
+    # An episode can take u -> v when some walk from the start reaches u
+    # without passing through v or stopping at the goal on the way. Other
+    # edges keep Q = 0, so they are left out of the value iteration reference.
+    adjacency = qlearnsolver.adjacency
+    start, goal = qlearnsolver.start, qlearnsolver.goal
+    takeable = np.zeros(adjacency.num_edges, dtype=bool)
+    for v in range(0, qlearnsolver.num_nodes):
+        if v == start:
+            continue
+        reached = {start}
+        frontier = [start]
+        while frontier:
+            u = frontier.pop()
+            if u == goal:
+                continue
+            for w in adjacency.neighbors(u).tolist():
+                if w != v and w not in reached:
+                    reached.add(w)
+                    frontier.append(w)
+        for u in reached:
+            pos = adjacency.find(u, v)
+            if u != goal and pos >= 0:
+                takeable[pos] = True
+    return takeable
+
+
+def check_convergence(seeds=range(0, 10), lams=(0.0, 0.5, 0.9, 1.0), num_nodes=15, density=0.25, gamma=0.9,
+                      num_episodes=5000):
+    # Trains every lambda on random graphs with branching and cycles, and
+    # returns, for each, the largest difference to value iteration over the
+    # edges episodes can take
+    errors = dict((lam, 0.0) for lam in lams)
+    for seed in seeds:
+        qlearnsolver = random_solver(num_nodes, 0.0, density, gamma, seed)
+        adjacency = qlearnsolver.adjacency
+        takeable = takeable_edges(qlearnsolver)
+        edges = np.flatnonzero(takeable)
+        reference_solver = QLearnSolver(num_nodes, qlearnsolver.start, qlearnsolver.goal, QLearner(num_nodes, gamma),
+                                        adjacency=CSRMatrix.from_edges(num_nodes, adjacency.row_ids()[edges],
+                                                                       adjacency.indices[edges], adjacency.data[edges]))
+        reference_solver.execute_value_iteration(tolerance=1e-12)
+        reference = reference_solver.qlearner.get_edge_Q_values(reference_solver.adjacency,
+                                                                np.arange(reference_solver.adjacency.num_edges))
+
+        for lam in lams:
+            random.seed(seed)
+            qlearnsolver = random_solver(num_nodes, lam, density, gamma, seed)
+            for i in range(0, num_episodes):
+                qlearnsolver.execute_training()
+            Q = qlearnsolver.qlearner.get_edge_Q_values(adjacency, edges)
+            errors[lam] = max(errors[lam], float(np.abs(Q - reference).max()))
+    return errors
+
+
+def benchmark(diameters=(5, 10, 20, 50, 100), lams=(0.0, 0.5, 0.9, 1.0), gamma=0.9, tolerance=1e-3,
+              max_episodes=5000, seed=0):
+    results = []
+    for diameter in diameters:
+        reference_solver = chain_solver(diameter, 0.0, gamma, seed)
+        reference_solver.execute_value_iteration(tolerance=1e-12)
+        reference = reference_solver.qlearner.get_edge_Q_values(reference_solver.adjacency,
+                                                                np.arange(reference_solver.adjacency.num_edges))
+        row = {"diameter": diameter}
+        for lam in lams:
+            random.seed(seed)
+            row[lam] = episodes_to_convergence(chain_solver(diameter, lam, gamma, seed), reference,
+                                               tolerance, max_episodes)
+        results.append(row)
+
+    print("Episodes to convergence (- means more than %s)" % max_episodes)
+    print("Diameter " + " ".join("lambda=%-5s" % lam for lam in lams))
+    for row in results:
+        print("%8d " % row["diameter"] + " ".join("%-12s" % (row[lam] or "-") for lam in lams))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--diameters", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument("--lambdas", type=float, nargs="+", default=[0.0, 0.5, 0.9, 1.0])
+    parser.add_argument("--gamma", type=float, default=0.9)
+    parser.add_argument("--max-episodes", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true",
+                        help="check that every lambda converges to the value iteration Q on branching graphs")
+    args = parser.parse_args()
+    if args.check:
+        errors = check_convergence(range(args.seed, args.seed + 10), args.lambdas, gamma=args.gamma)
+        for lam, error in errors.items():
+            print("lambda=%-5s Max Q error: %s%s" % (lam, error, "" if error <= 1e-6 else " (did not converge)"))
+        return
+    benchmark(args.diameters, args.lambdas, args.gamma, max_episodes=args.max_episodes, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()